@@ -1,12 +1,26 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
 import json
+import atexit
+import base64
 import hashlib
-from PIL import Image
+import hmac
 import os
+import queue
+import random
+import secrets
+import select
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from dotenv import load_dotenv
 import smtplib
 from email.mime.text import MIMEText
@@ -174,50 +188,99 @@ def generer_email_confirmation_commande(client_nom, produit_nom, quantite, monta
 
 # ========== GESTION CONNEXION POSTGRESQL (SUPABASE) ==========
 
+# Keepalives TCP : évite que les connexions inactives du pool soient coupées
+# par le NAT/load balancer de Supabase entre deux reruns
+KEEPALIVE_KWARGS = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 5,
+}
+
+# Sources des paramètres de connexion, essayées dans l'ordre : variables d'environnement puis st.secrets
+CONNECTION_PARAMS_SOURCES = [
+    lambda: dict(host=os.getenv('SUPABASE_HOST'),
+                 database=os.getenv('SUPABASE_DB', 'postgres'),
+                 user=os.getenv('SUPABASE_USER', 'postgres'),
+                 password=os.getenv('SUPABASE_PASSWORD'),
+                 port=os.getenv('SUPABASE_PORT', '5432')),
+    lambda: dict(host=st.secrets["supabase"]["host"],
+                 database=st.secrets["supabase"]["database"],
+                 user=st.secrets["supabase"]["user"],
+                 password=st.secrets["supabase"]["password"],
+                 port=st.secrets["supabase"]["port"]),
+]
+
 @st.cache_resource
 def init_connection_pool():
-    """Initialise un pool de connexions PostgreSQL"""
-    try:
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 10,  # Réduit de 20 à 10 connexions max
-            host=os.getenv('SUPABASE_HOST'),
-            database=os.getenv('SUPABASE_DB', 'postgres'),
-            user=os.getenv('SUPABASE_USER', 'postgres'),
-            password=os.getenv('SUPABASE_PASSWORD'),
-            port=os.getenv('SUPABASE_PORT', '5432'),
-            connect_timeout=10  # Timeout de 10 secondes
-        )
-        return connection_pool
-    except Exception as e:
+    """Initialise un pool de connexions PostgreSQL (thread-safe, partagé entre sessions) ;
+    retourne (pool, paramètres de connexion retenus)"""
+    for source in CONNECTION_PARAMS_SOURCES:
         try:
-            connection_pool = psycopg2.pool.SimpleConnectionPool(
-                1, 10,
-                host=st.secrets["supabase"]["host"],
-                database=st.secrets["supabase"]["database"],
-                user=st.secrets["supabase"]["user"],
-                password=st.secrets["supabase"]["password"],
-                port=st.secrets["supabase"]["port"],
-                connect_timeout=10
-            )
-            return connection_pool
-        except Exception as e2:
-            st.error(f"❌ Erreur de connexion à la base de données: {e2}")
-            st.stop()
+            params = dict(source(), connect_timeout=10, **KEEPALIVE_KWARGS)  # Timeout de 10 secondes
+            connection_pool = psycopg2.pool.ThreadedConnectionPool(2, 10, **params)  # Réduit de 20 à 10 connexions max
+            return connection_pool, params
+        except Exception as e:
+            erreur = e
+    st.error(f"❌ Erreur de connexion à la base de données: {erreur}")
+    st.stop()
+
+# Pool mémorisé dans un global du module : une seule recherche st.cache_resource par exécution
+# du script au lieu de deux par opération (get + release)
+_pool = None
+_connection_params = None
+
+def get_pool():
+    global _pool, _connection_params
+    if _pool is None:
+        _pool, _connection_params = init_connection_pool()
+    return _pool
+
+def get_connection_params():
+    """Paramètres de connexion du pool (pour les connexions dédiées hors pool)"""
+    get_pool()
+    return _connection_params
+
+# Au-delà de ce délai d'inactivité, la connexion est vérifiée (SELECT 1) avant d'être rendue
+POOL_PRE_PING_SECONDS = 30
+
+@st.cache_resource
+def get_connection_last_used():
+    """Date de dernière restitution au pool de chaque connexion (références faibles)"""
+    return weakref.WeakKeyDictionary()
+
+def is_connection_alive(conn):
+    """Vérifie une connexion restée inactive ; les connexions récemment utilisées sont supposées saines"""
+    if conn.closed:
+        return False
+    last_used = get_connection_last_used().get(conn)
+    if last_used is not None and time.monotonic() - last_used < POOL_PRE_PING_SECONDS:
+        return True
+    try:
+        c = conn.cursor()
+        c.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 def get_connection():
     """Obtient une connexion depuis le pool avec retry"""
-    pool = init_connection_pool()
+    pool = get_pool()
     max_retries = 3
     for attempt in range(max_retries):
         try:
             conn = pool.getconn()
+            while conn and not is_connection_alive(conn):
+                # Connexion coupée côté serveur pendant l'inactivité : on la jette et on en prend une autre
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
             if conn:
                 return conn
         except Exception as e:
             if attempt == max_retries - 1:
                 st.error(f"❌ Impossible d'obtenir une connexion après {max_retries} tentatives")
                 raise
-            import time
             time.sleep(0.5)  # Attendre 0.5s avant de réessayer
     return None
 
@@ -225,7 +288,9 @@ def release_connection(conn):
     """Libère une connexion vers le pool avec gestion d'erreur"""
     try:
         if conn:
-            pool = init_connection_pool()
+            pool = get_pool()
+            # Le pool psycopg2 est LIFO : la connexion restituée est la prochaine resservie
+            get_connection_last_used()[conn] = time.monotonic()
             pool.putconn(conn)
     except Exception as e:
         print(f"Erreur libération connexion: {e}")
@@ -236,325 +301,684 @@ def release_connection(conn):
         except:
             pass
 
+@contextmanager
+def db_cursor():
+    """Curseur sur une connexion du pool : commit en sortie, rollback sur erreur, connexion toujours rendue.
+    Ne pas appeler st.rerun()/st.stop() dans le bloc (exceptions de contrôle : pas de commit)."""
+    conn = get_connection()
+    try:
+        ensure_prepared(conn)
+        c = conn.cursor()
+        yield c
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+# Requêtes les plus fréquentes, préparées une seule fois par connexion physique
+PREPARED_STATEMENTS = {
+    # Utilisateur + permissions agrégées en JSON : un seul aller-retour à la connexion
+    'verify_login_p': """SELECT u.id, u.role, u.password,
+                                COALESCE(json_object_agg(p.module, json_build_object(
+                                             'lecture', COALESCE(p.acces_lecture, FALSE),
+                                             'ecriture', COALESCE(p.acces_ecriture, FALSE)))
+                                         FILTER (WHERE p.module IS NOT NULL), '{}'::json)
+                         FROM utilisateurs u
+                         LEFT JOIN permissions p ON p.user_id = u.id
+                         WHERE u.username = $1
+                         GROUP BY u.id""",
+    'load_session_p': """UPDATE sessions SET last_activity = NOW()
+                         WHERE session_id = $1 AND last_activity > NOW() - INTERVAL '1 day'
+                         RETURNING user_id, username, role""",
+    'save_session_p': """INSERT INTO sessions (session_id, user_id, username, role, last_activity)
+                         VALUES ($1, $2, $3, $4, NOW())
+                         ON CONFLICT (session_id) DO UPDATE SET last_activity = NOW()""",
+    'delete_session_p': """DELETE FROM sessions WHERE session_id = $1""",
+    'user_permissions_p': """SELECT module, acces_lecture, acces_ecriture FROM permissions WHERE user_id = $1""",
+    'pending_orders_count_p': """SELECT COUNT(*) FROM commandes WHERE statut = 'En attente'""",
+    # Écritures des formulaires : plan mis en cache par connexion
+    'log_acces_p': """INSERT INTO logs_acces (user_id, module, action) VALUES ($1, $2, $3)""",
+    'ajouter_client_p': """INSERT INTO clients (nom, email, telephone, date_creation)
+                           VALUES ($1, $2, $3, CURRENT_DATE)""",
+    'ajouter_produit_p': """INSERT INTO produits (nom, prix, stock, seuil_alerte) VALUES ($1, $2, $3, $4)""",
+    'ajuster_stock_p': """UPDATE produits SET stock = stock + $1::int WHERE id = $2""",
+    'maj_statut_commande_p': """UPDATE commandes SET statut = $1 WHERE id = $2""",
+    'creer_commande_p': """WITH stock_maj AS (
+                               UPDATE produits SET stock = stock - $1::int
+                               WHERE id = $2::int AND stock >= $1::int
+                               RETURNING id
+                           )
+                           INSERT INTO commandes (client_id, produit_id, quantite, date, statut)
+                           SELECT $3::int, id, $1::int, CURRENT_DATE, 'En cours' FROM stock_maj
+                           RETURNING id""",
+}
+
+@st.cache_resource
+def get_prepared_registry():
+    """Ensemble (faible) des connexions du pool sur lesquelles PREPARE a déjà été exécuté"""
+    return weakref.WeakSet()
+
+def ensure_prepared(conn):
+    """Prépare les requêtes fréquentes sur la connexion si ce n'est pas déjà fait"""
+    registry = get_prepared_registry()
+    if conn in registry:
+        return
+    # Toutes les préparations en un seul aller-retour. DEALLOCATE ALL d'abord : PREPARE n'est pas
+    # annulé par un rollback, une connexion restée à moitié préparée après une erreur repart de zéro
+    conn.cursor().execute("DEALLOCATE ALL;" + ";".join(
+        f"PREPARE {name} AS {query}" for name, query in PREPARED_STATEMENTS.items()))
+    conn.commit()
+    registry.add(conn)
+
 # ========== INITIALISATION BASE DE DONNÉES ==========
+SCHEMA_SQL = """
+-- Table Utilisateurs
+CREATE TABLE IF NOT EXISTS utilisateurs
+    (id SERIAL PRIMARY KEY,
+     username VARCHAR(100) UNIQUE NOT NULL,
+     password VARCHAR(255) NOT NULL,
+     role VARCHAR(50) NOT NULL,
+     date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+-- Table Permissions
+CREATE TABLE IF NOT EXISTS permissions
+    (id SERIAL PRIMARY KEY,
+     user_id INTEGER REFERENCES utilisateurs(id) ON DELETE CASCADE,
+     module VARCHAR(100) NOT NULL,
+     acces_lecture BOOLEAN DEFAULT FALSE,
+     acces_ecriture BOOLEAN DEFAULT FALSE);
+
+-- Table Clients
+CREATE TABLE IF NOT EXISTS clients
+    (id SERIAL PRIMARY KEY,
+     nom VARCHAR(255) NOT NULL,
+     email VARCHAR(255),
+     telephone VARCHAR(50),
+     date_creation DATE);
+
+-- Table Produits
+CREATE TABLE IF NOT EXISTS produits
+    (id SERIAL PRIMARY KEY,
+     nom VARCHAR(255) NOT NULL,
+     prix DECIMAL(10,2) NOT NULL,
+     stock INTEGER NOT NULL,
+     seuil_alerte INTEGER DEFAULT 10);
+
+-- Table Fournisseurs
+CREATE TABLE IF NOT EXISTS fournisseurs
+    (id SERIAL PRIMARY KEY,
+     nom VARCHAR(255) NOT NULL,
+     email VARCHAR(255),
+     telephone VARCHAR(50),
+     adresse TEXT,
+     date_creation DATE);
+
+-- Table Commandes
+CREATE TABLE IF NOT EXISTS commandes
+    (id SERIAL PRIMARY KEY,
+     client_id INTEGER REFERENCES clients(id),
+     produit_id INTEGER REFERENCES produits(id),
+     quantite INTEGER,
+     date DATE,
+     statut VARCHAR(50));
+
+-- Table Achats
+CREATE TABLE IF NOT EXISTS achats
+    (id SERIAL PRIMARY KEY,
+     fournisseur_id INTEGER REFERENCES fournisseurs(id),
+     produit_id INTEGER REFERENCES produits(id),
+     quantite INTEGER,
+     prix_unitaire DECIMAL(10,2),
+     date DATE,
+     statut VARCHAR(50));
+
+-- Table Sessions
+CREATE TABLE IF NOT EXISTS sessions
+    (id SERIAL PRIMARY KEY,
+     session_id VARCHAR(255) UNIQUE,
+     user_id INTEGER REFERENCES utilisateurs(id),
+     username VARCHAR(100),
+     role VARCHAR(50),
+     last_activity TIMESTAMP);
+
+-- Table Logs
+CREATE TABLE IF NOT EXISTS logs_acces
+    (id SERIAL PRIMARY KEY,
+     user_id INTEGER REFERENCES utilisateurs(id),
+     module VARCHAR(100),
+     action TEXT,
+     date_heure TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+-- Index sur les colonnes filtrées à chaque rerun
+CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity);
+CREATE INDEX IF NOT EXISTS idx_perms_user ON permissions(user_id);
+CREATE INDEX IF NOT EXISTS idx_logs_user_time ON logs_acces(user_id, date_heure DESC);
+
+-- Tri des listes paginées (ORDER BY date DESC NULLS LAST, id DESC LIMIT/OFFSET)
+CREATE INDEX IF NOT EXISTS idx_commandes_date ON commandes(date DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS idx_achats_date ON achats(date DESC NULLS LAST, id DESC);
+-- Compteur du badge : index partiel, seules les commandes en attente y figurent
+CREATE INDEX IF NOT EXISTS idx_commandes_en_attente ON commandes(id) WHERE statut = 'En attente';
+-- Clés étrangères (jointures des listes, contrôles avant suppression)
+CREATE INDEX IF NOT EXISTS idx_commandes_client ON commandes(client_id);
+CREATE INDEX IF NOT EXISTS idx_commandes_produit ON commandes(produit_id);
+CREATE INDEX IF NOT EXISTS idx_achats_fournisseur ON achats(fournisseur_id);
+CREATE INDEX IF NOT EXISTS idx_achats_produit ON achats(produit_id);
+-- Recherche du client par email (insensible à la casse) du formulaire de commande public
+CREATE INDEX IF NOT EXISTS idx_clients_email_lower ON clients(LOWER(email));
+
+-- Notification LISTEN/NOTIFY à chaque changement des commandes (badge "en attente")
+CREATE OR REPLACE FUNCTION notify_commandes_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('commandes_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+-- Créé seulement s'il manque : pas de verrou sur commandes à chaque démarrage d'un worker
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgname = 'trg_commandes_changed' AND tgrelid = 'commandes'::regclass) THEN
+        CREATE TRIGGER trg_commandes_changed
+            AFTER INSERT OR DELETE OR UPDATE OF statut ON commandes
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_commandes_changed();
+    END IF;
+END
+$$;
+"""
+
+DEMO_DATA_SQL = """
+INSERT INTO clients (nom, email, telephone, date_creation) VALUES 
+    ('Entreprise Alpha', 'contact@alpha.com', '0612345678', CURRENT_DATE),
+    ('Société Beta', 'info@beta.com', '0698765432', CURRENT_DATE);
+
+INSERT INTO produits (nom, prix, stock, seuil_alerte) VALUES 
+    ('Ordinateur Portable', 899.99, 15, 5),
+    ('Souris Sans Fil', 29.99, 50, 20),
+    ('Clavier Mécanique', 79.99, 30, 10);
+
+INSERT INTO fournisseurs (nom, email, telephone, adresse, date_creation) VALUES 
+    ('TechSupply Co', 'contact@techsupply.com', '0511223344', '12 Rue de la Tech, Paris', CURRENT_DATE),
+    ('GlobalParts', 'info@globalparts.com', '0522334455', '45 Avenue du Commerce, Lyon', CURRENT_DATE);
+
+INSERT INTO commandes (client_id, produit_id, quantite, date, statut) VALUES 
+    (1, 1, 2, CURRENT_DATE - INTERVAL '5 days', 'Livrée'),
+    (2, 2, 5, CURRENT_DATE - INTERVAL '2 days', 'En cours');
+"""
+
 def init_database():
-    """Initialise les tables PostgreSQL"""
+    """Initialise les tables PostgreSQL ; retourne True si l'initialisation a réussi"""
     conn = get_connection()
     try:
         c = conn.cursor()
         
-        # Table Utilisateurs
-        c.execute('''CREATE TABLE IF NOT EXISTS utilisateurs
-                     (id SERIAL PRIMARY KEY,
-                      username VARCHAR(100) UNIQUE NOT NULL,
-                      password VARCHAR(255) NOT NULL,
-                      role VARCHAR(50) NOT NULL,
-                      date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        
-        # Table Permissions
-        c.execute('''CREATE TABLE IF NOT EXISTS permissions
-                     (id SERIAL PRIMARY KEY,
-                      user_id INTEGER REFERENCES utilisateurs(id) ON DELETE CASCADE,
-                      module VARCHAR(100) NOT NULL,
-                      acces_lecture BOOLEAN DEFAULT FALSE,
-                      acces_ecriture BOOLEAN DEFAULT FALSE)''')
-        
-        # Table Clients
-        c.execute('''CREATE TABLE IF NOT EXISTS clients
-                     (id SERIAL PRIMARY KEY,
-                      nom VARCHAR(255) NOT NULL,
-                      email VARCHAR(255),
-                      telephone VARCHAR(50),
-                      date_creation DATE)''')
+        # Plusieurs processus (workers) peuvent démarrer ensemble : un seul à la fois
+        # exécute le DDL et les données initiales (verrou libéré au commit final)
+        c.execute("SELECT pg_advisory_xact_lock(hashtext('sygep_schema'))")
         
-        # Table Produits
-        c.execute('''CREATE TABLE IF NOT EXISTS produits
-                     (id SERIAL PRIMARY KEY,
-                      nom VARCHAR(255) NOT NULL,
-                      prix DECIMAL(10,2) NOT NULL,
-                      stock INTEGER NOT NULL,
-                      seuil_alerte INTEGER DEFAULT 10)''')
+        # Tout le schéma (tables + index) et les sondes d'amorçage en un seul aller-retour :
+        # psycopg2 renvoie le résultat de la dernière instruction
+        c.execute(SCHEMA_SQL + """
+            SELECT EXISTS (SELECT 1 FROM utilisateurs WHERE username = 'admin'),
+                   EXISTS (SELECT 1 FROM clients);""")
+        admin_existe, donnees_existent = c.fetchone()
         
-        # Table Fournisseurs
-        c.execute('''CREATE TABLE IF NOT EXISTS fournisseurs
-                     (id SERIAL PRIMARY KEY,
-                      nom VARCHAR(255) NOT NULL,
-                      email VARCHAR(255),
-                      telephone VARCHAR(50),
-                      adresse TEXT,
-                      date_creation DATE)''')
-        
-        # Table Commandes
-        c.execute('''CREATE TABLE IF NOT EXISTS commandes
-                     (id SERIAL PRIMARY KEY,
-                      client_id INTEGER REFERENCES clients(id),
-                      produit_id INTEGER REFERENCES produits(id),
-                      quantite INTEGER,
-                      date DATE,
-                      statut VARCHAR(50))''')
-        
-        # Table Achats
-        c.execute('''CREATE TABLE IF NOT EXISTS achats
-                     (id SERIAL PRIMARY KEY,
-                      fournisseur_id INTEGER REFERENCES fournisseurs(id),
-                      produit_id INTEGER REFERENCES produits(id),
-                      quantite INTEGER,
-                      prix_unitaire DECIMAL(10,2),
-                      date DATE,
-                      statut VARCHAR(50))''')
-        
-        # Table Sessions
-        c.execute('''CREATE TABLE IF NOT EXISTS sessions
-                     (id SERIAL PRIMARY KEY,
-                      session_id VARCHAR(255) UNIQUE,
-                      user_id INTEGER REFERENCES utilisateurs(id),
-                      username VARCHAR(100),
-                      role VARCHAR(50),
-                      last_activity TIMESTAMP)''')
+        # Créer utilisateur admin par défaut si n'existe pas (le hash Argon2 n'est calculé que dans ce cas)
+        if not admin_existe:
+            password_hash = hash_password("admin123")
+            c.execute("""INSERT INTO utilisateurs (username, password, role) VALUES (%s, %s, %s)
+                         ON CONFLICT (username) DO NOTHING RETURNING id""",
+                      ('admin', password_hash, 'admin'))
+            row = c.fetchone()
+            if row:
+                modules = ["tableau_bord", "clients", "produits", "fournisseurs", "commandes", "achats", "rapports", "utilisateurs"]
+                execute_values(c, "INSERT INTO permissions (user_id, module, acces_lecture, acces_ecriture) VALUES %s",
+                               [(row[0], module, True, True) for module in modules])
         
-        # Table Logs
-        c.execute('''CREATE TABLE IF NOT EXISTS logs_acces
-                     (id SERIAL PRIMARY KEY,
-                      user_id INTEGER REFERENCES utilisateurs(id),
-                      module VARCHAR(100),
-                      action TEXT,
-                      date_heure TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        # Ajouter données de démonstration si tables vides (un seul aller-retour pour tout le jeu)
+        if not donnees_existent:
+            c.execute(DEMO_DATA_SQL)
         
+        # Un seul commit pour le schéma, l'admin par défaut et les données de démonstration
         conn.commit()
-        
-        # Créer utilisateur admin par défaut si n'existe pas
-        c.execute("SELECT COUNT(*) FROM utilisateurs WHERE username = %s", ('admin',))
-        if c.fetchone()[0] == 0:
-            password_hash = hashlib.sha256("admin123".encode()).hexdigest()
-            c.execute("INSERT INTO utilisateurs (username, password, role) VALUES (%s, %s, %s) RETURNING id",
-                      ('admin', password_hash, 'admin'))
-            user_id = c.fetchone()[0]
-            
-            modules = ["tableau_bord", "clients", "produits", "fournisseurs", "commandes", "achats", "rapports", "utilisateurs"]
-            for module in modules:
-                c.execute("INSERT INTO permissions (user_id, module, acces_lecture, acces_ecriture) VALUES (%s, %s, %s, %s)",
-                          (user_id, module, True, True))
-            
-            conn.commit()
-        
-        # Ajouter données de démonstration si tables vides
-        c.execute("SELECT COUNT(*) FROM clients")
-        if c.fetchone()[0] == 0:
-            c.execute("""INSERT INTO clients (nom, email, telephone, date_creation) VALUES 
-                        ('Entreprise Alpha', 'contact@alpha.com', '0612345678', CURRENT_DATE),
-                        ('Société Beta', 'info@beta.com', '0698765432', CURRENT_DATE)""")
-            
-            c.execute("""INSERT INTO produits (nom, prix, stock, seuil_alerte) VALUES 
-                        ('Ordinateur Portable', 899.99, 15, 5),
-                        ('Souris Sans Fil', 29.99, 50, 20),
-                        ('Clavier Mécanique', 79.99, 30, 10)""")
-            
-            c.execute("""INSERT INTO fournisseurs (nom, email, telephone, adresse, date_creation) VALUES 
-                        ('TechSupply Co', 'contact@techsupply.com', '0511223344', '12 Rue de la Tech, Paris', CURRENT_DATE),
-                        ('GlobalParts', 'info@globalparts.com', '0522334455', '45 Avenue du Commerce, Lyon', CURRENT_DATE)""")
-            
-            c.execute("""INSERT INTO commandes (client_id, produit_id, quantite, date, statut) VALUES 
-                        (1, 1, 2, CURRENT_DATE - INTERVAL '5 days', 'Livrée'),
-                        (2, 2, 5, CURRENT_DATE - INTERVAL '2 days', 'En cours')""")
-            
-            conn.commit()
+        return True
             
     except Exception as e:
         st.error(f"Erreur initialisation BDD: {e}")
         conn.rollback()
+        return False
     finally:
         release_connection(conn)
 
+@st.cache_resource(show_spinner=False)
+def init_database_once():
+    """Exécute init_database() une seule fois par processus (un échec n'est pas mis en cache)"""
+    if not init_database():
+        raise RuntimeError("Initialisation de la base de données échouée")
+    return True
+
 # ========== FONCTIONS UTILITAIRES ==========
+# Argon2id salé : coût volontaire payé une seule fois par connexion réelle
+# (la restauration de session via session_id ne revérifie pas le mot de passe)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return password_hasher.hash(password)
 
-def verify_login(username, password):
-    conn = get_connection()
+@st.cache_resource
+def get_dummy_hash():
+    """Hash Argon2 factice (calculé une fois par processus) vérifié pour les identifiants inconnus"""
+    return hash_password(secrets.token_hex(16))
+
+def verify_password(stored_hash, password):
+    """Vérifie un mot de passe ; retourne (valide, nouveau_hash ou None si pas de migration)"""
+    if not stored_hash.startswith("$argon2"):
+        # Ancien format SHA-256 non salé : migré vers Argon2 à la première connexion réussie
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        if hmac.compare_digest(stored_hash, legacy_hash):
+            return True, hash_password(password)
+        return False, None
     try:
-        c = conn.cursor()
-        password_hash = hash_password(password)
-        c.execute("SELECT id, role FROM utilisateurs WHERE username=%s AND password=%s", (username, password_hash))
-        result = c.fetchone()
-        return result if result else None
-    finally:
-        release_connection(conn)
+        password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    if password_hasher.check_needs_rehash(stored_hash):
+        return True, hash_password(password)
+    return True, None
 
+def verify_login(username, password):
+    """Retourne (user_id, role, permissions) si les identifiants sont valides, sinon None"""
+    with db_cursor() as c:
+        c.execute("EXECUTE verify_login_p (%s)", (username,))
+        result = c.fetchone()
+        if not result:
+            # Même coût Argon2 qu'un identifiant existant : le temps de réponse ne révèle pas les comptes
+            verify_password(get_dummy_hash(), password)
+            return None
+        user_id, role, stored_hash, permissions = result
+        valid, new_hash = verify_password(stored_hash, password)
+        if not valid:
+            return None
+        if new_hash:
+            c.execute("UPDATE utilisateurs SET password = %s WHERE id = %s", (new_hash, user_id))
+        return user_id, role, permissions
+
+@st.cache_data(ttl=300, max_entries=1024, show_spinner=False)
 def get_user_permissions(user_id):
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute("SELECT module, acces_lecture, acces_ecriture FROM permissions WHERE user_id=%s", (user_id,))
-        permissions = {}
-        for row in c.fetchall():
-            permissions[row[0]] = {
-                'lecture': bool(row[1]),
-                'ecriture': bool(row[2])
-            }
-        return permissions
-    finally:
-        release_connection(conn)
+    """Permissions par module d'un utilisateur (invalidé à l'enregistrement des permissions)"""
+    with db_cursor() as c:
+        c.execute("EXECUTE user_permissions_p (%s)", (user_id,))
+        # psycopg2 renvoie déjà des booléens Python
+        return {module: {'lecture': lecture, 'ecriture': ecriture}
+                for module, lecture, ecriture in c.fetchall()}
+
+def get_access_set(permissions):
+    """Couples (module, type d'accès) autorisés, précalculés une fois à la connexion"""
+    return frozenset((module, access_type)
+                     for module, perms in permissions.items()
+                     for access_type, autorise in perms.items() if autorise)
 
 def has_access(module, access_type='lecture'):
-    if st.session_state.role == "admin":
+    # Un seul test d'appartenance à chaque rendu (l'admin a accès à tout)
+    return st.session_state.role == "admin" or (module, access_type) in st.session_state.access_set
+
+SUBMIT_DEBOUNCE_SECONDS = 1.0
+
+def is_double_submit(*key):
+    """True si la même action avec les mêmes valeurs vient d'être soumise (double-clic)"""
+    now = time.monotonic()
+    last = st.session_state.get('_last_submit')
+    st.session_state['_last_submit'] = (key, now)
+    if last is not None and last[0] == key and now - last[1] < SUBMIT_DEBOUNCE_SECONDS:
+        st.info("⏳ Action déjà prise en compte (double clic ignoré)")
         return True
-    permissions = st.session_state.get('permissions', {})
-    module_perms = permissions.get(module, {'lecture': False, 'ecriture': False})
-    return module_perms.get(access_type, False)
+    return False
 
-def log_access(user_id, module, action):
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute("INSERT INTO logs_acces (user_id, module, action) VALUES (%s, %s, %s)",
-                  (user_id, module, action))
-        conn.commit()
-    finally:
-        release_connection(conn)
+LOG_QUEUE_MAXSIZE = 1000
+LOG_BATCH_SIZE = 256
+LOG_FLUSH_INTERVAL = 0.5  # secondes d'accumulation maximum après la première entrée d'un lot
 
-@st.cache_data(ttl=60)
-def get_clients():
-    conn = get_connection()
-    try:
-        df = pd.read_sql_query("SELECT * FROM clients ORDER BY id", conn)
-        return df
-    finally:
-        release_connection(conn)
+@st.cache_resource
+def start_log_writer():
+    """File + thread (un par processus) qui écrit les logs d'accès hors du chemin de la requête"""
+    file_logs = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+    
+    def ecrire_lot(entrees):
+        try:
+            with db_cursor() as c:
+                execute_values(c, "INSERT INTO logs_acces (user_id, module, action) VALUES %s", entrees,
+                               page_size=LOG_BATCH_SIZE)
+        except Exception as e:
+            # Une ligne invalide (ex. utilisateur supprimé) fait échouer tout le lot :
+            # réécriture ligne par ligne, seules les lignes fautives sont perdues
+            print(f"Erreur écriture lot de logs d'accès, reprise ligne par ligne: {e}")
+            for entree in entrees:
+                try:
+                    with db_cursor() as c:
+                        c.execute("EXECUTE log_acces_p (%s, %s, %s)", entree)
+                except Exception as e:
+                    print(f"Log d'accès ignoré {entree}: {e}")
+    
+    def ecrire():
+        while True:
+            # Attendre une entrée puis accumuler jusqu'à LOG_BATCH_SIZE lignes ou LOG_FLUSH_INTERVAL
+            entrees = [file_logs.get()]
+            limite = time.monotonic() + LOG_FLUSH_INTERVAL
+            while len(entrees) < LOG_BATCH_SIZE:
+                restant = limite - time.monotonic()
+                if restant <= 0:
+                    break
+                try:
+                    entrees.append(file_logs.get(timeout=restant))
+                except queue.Empty:
+                    break
+            ecrire_lot(entrees)
+    
+    def vider():
+        # Arrêt du processus : écrire ce qui reste en file (le thread démon est tué sans prévenir)
+        entrees = []
+        while True:
+            try:
+                entrees.append(file_logs.get_nowait())
+            except queue.Empty:
+                break
+        if entrees:
+            ecrire_lot(entrees)
+    
+    atexit.register(vider)
+    thread = threading.Thread(target=ecrire, name="access-log-writer", daemon=True)
+    thread.start()
+    return file_logs
 
-@st.cache_data(ttl=60)
-def get_produits():
-    conn = get_connection()
+def log_access(user_id, module, action):
+    """Journalise un accès sans bloquer la page (écriture synchrone si la file est pleine)"""
     try:
-        df = pd.read_sql_query("SELECT * FROM produits ORDER BY id", conn)
-        return df
-    finally:
-        release_connection(conn)
+        start_log_writer().put_nowait((user_id, module, action))
+    except queue.Full:
+        with db_cursor() as c:
+            c.execute("EXECUTE log_acces_p (%s, %s, %s)", (user_id, module, action))
+
+def query_df(query, params=None):
+    """Exécute une requête et construit le DataFrame directement depuis le curseur"""
+    with db_cursor() as c:
+        c.execute(query, params)
+        columns = [d.name for d in c.description]
+        return pd.DataFrame.from_records(c.fetchall(), columns=columns, coerce_float=True)
+
+# Listes paginées : clause FROM et colonnes couvertes par la recherche
+PAGE_SIZE = 50
+LOGS_PAGE_SIZE = 50
+# Une entrée de cache par (page, recherche) : borne la mémoire quand les recherches varient
+LIST_CACHE_MAX_ENTRIES = 128
+LIST_SOURCES = {
+    'clients': ("FROM clients", ["nom", "email"]),
+    'produits': ("FROM produits", ["nom"]),
+    'commandes': ("""FROM commandes c
+    JOIN clients cl ON c.client_id = cl.id
+    JOIN produits p ON c.produit_id = p.id""", ["cl.nom", "p.nom", "c.statut"]),
+    'achats': ("""FROM achats a
+    JOIN fournisseurs f ON a.fournisseur_id = f.id
+    JOIN produits p ON a.produit_id = p.id""", ["f.nom", "p.nom", "a.statut"]),
+}
 
-@st.cache_data(ttl=60)
+def build_search_filter(columns, search):
+    """Construit la clause WHERE (ILIKE sur chaque colonne) et ses paramètres"""
+    if not search:
+        return "", []
+    # Les caractères spéciaux de LIKE saisis par l'utilisateur sont recherchés tels quels
+    echappe = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{echappe}%"
+    where = " WHERE " + " OR ".join(f"{col} ILIKE %s ESCAPE E'\\\\'" for col in columns)
+    return where, [pattern] * len(columns)
+
+@st.cache_data(ttl=60, max_entries=LIST_CACHE_MAX_ENTRIES, show_spinner=False)
+def count_rows(source, search=None):
+    """Nombre total de lignes d'une liste (pour la pagination)"""
+    from_clause, columns = LIST_SOURCES[source]
+    where, params = build_search_filter(columns, search)
+    with db_cursor() as c:
+        c.execute(f"SELECT COUNT(*) {from_clause}{where}", params)
+        return c.fetchone()[0]
+
+def render_pagination(source, search=None):
+    """Affiche le sélecteur de page d'une liste et retourne l'offset SQL"""
+    total = count_rows(source, search)
+    nb_pages = max(1, -(-total // PAGE_SIZE))
+    key = f"page_{source}"
+    # Nouvelle recherche : retour à la première page des résultats filtrés
+    if st.session_state.get(f"{key}_search") != search:
+        st.session_state[f"{key}_search"] = search
+        st.session_state[key] = 1
+    elif st.session_state.get(key, 1) > nb_pages:
+        st.session_state[key] = nb_pages
+    page = st.number_input(f"Page (sur {nb_pages} - {total} ligne(s))", min_value=1, max_value=nb_pages,
+                           step=1, key=key)
+    return (int(page) - 1) * PAGE_SIZE
+
+@st.cache_data(ttl=60, max_entries=LIST_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_clients(limit=None, offset=0, search=None):
+    from_clause, columns = LIST_SOURCES['clients']
+    where, params = build_search_filter(columns, search)
+    return query_df(f"SELECT id, nom, email, telephone, date_creation {from_clause}{where} ORDER BY id LIMIT %s OFFSET %s",
+                    params + [limit, offset])
+
+@st.cache_data(ttl=60, max_entries=LIST_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_produits(limit=None, offset=0, search=None):
+    from_clause, columns = LIST_SOURCES['produits']
+    where, params = build_search_filter(columns, search)
+    return query_df(f"SELECT id, nom, prix, stock, seuil_alerte {from_clause}{where} ORDER BY id LIMIT %s OFFSET %s",
+                    params + [limit, offset])
+
+@st.cache_data(ttl=60, show_spinner=False)
 def get_fournisseurs():
-    conn = get_connection()
-    try:
-        df = pd.read_sql_query("SELECT * FROM fournisseurs ORDER BY id", conn)
-        return df
-    finally:
-        release_connection(conn)
-
-@st.cache_data(ttl=60)
-def get_commandes():
-    conn = get_connection()
-    try:
-        query = """
-        SELECT c.id, cl.nom as client, p.nom as produit, c.quantite, 
-               (c.quantite * p.prix) as montant, c.date, c.statut
-        FROM commandes c
-        JOIN clients cl ON c.client_id = cl.id
-        JOIN produits p ON c.produit_id = p.id
-        ORDER BY c.date DESC
-        """
-        df = pd.read_sql_query(query, conn)
-        return df
-    finally:
-        release_connection(conn)
-
-@st.cache_data(ttl=60)
-def get_achats():
-    conn = get_connection()
-    try:
-        query = """
-        SELECT a.id, f.nom as fournisseur, p.nom as produit, a.quantite, 
-               a.prix_unitaire, (a.quantite * a.prix_unitaire) as montant_total, a.date, a.statut
-        FROM achats a
-        JOIN fournisseurs f ON a.fournisseur_id = f.id
-        JOIN produits p ON a.produit_id = p.id
-        ORDER BY a.date DESC
-        """
-        df = pd.read_sql_query(query, conn)
-        return df
-    finally:
-        release_connection(conn)
-
-@st.cache_data(ttl=60)
-def get_produits_stock_faible():
-    conn = get_connection()
-    try:
-        df = pd.read_sql_query("SELECT * FROM produits WHERE stock <= seuil_alerte", conn)
-        return df
-    finally:
-        release_connection(conn)
-
-@st.cache_data(ttl=5) 
+    return query_df("SELECT id, nom, email, telephone, adresse, date_creation FROM fournisseurs ORDER BY id")
+
+@st.cache_data(ttl=60, max_entries=LIST_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_commandes(limit=None, offset=0, search=None):
+    from_clause, columns = LIST_SOURCES['commandes']
+    where, params = build_search_filter(columns, search)
+    query = f"""
+    SELECT c.id, cl.nom as client, p.nom as produit, c.quantite, 
+           (c.quantite * p.prix) as montant, c.date, c.statut
+    {from_clause}{where}
+    ORDER BY c.date DESC NULLS LAST, c.id DESC
+    LIMIT %s OFFSET %s
+    """
+    return query_df(query, params + [limit, offset])
+
+@st.cache_data(ttl=60, max_entries=LIST_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_achats(limit=None, offset=0, search=None):
+    from_clause, columns = LIST_SOURCES['achats']
+    where, params = build_search_filter(columns, search)
+    query = f"""
+    SELECT a.id, f.nom as fournisseur, p.nom as produit, a.quantite, 
+           a.prix_unitaire, (a.quantite * a.prix_unitaire) as montant_total, a.date, a.statut
+    {from_clause}{where}
+    ORDER BY a.date DESC NULLS LAST, a.id DESC
+    LIMIT %s OFFSET %s
+    """
+    return query_df(query, params + [limit, offset])
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_utilisateurs():
+    return query_df("SELECT id, username, role, date_creation FROM utilisateurs ORDER BY id")
+
+# TTL court : chaque consultation ajoute des logs, mais une page déjà vue se relit depuis la mémoire
+@st.cache_data(ttl=15, max_entries=LIST_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_logs(before_id=None):
+    """Page de logs d'accès, du plus récent au plus ancien (pagination par curseur : id < before_id)"""
+    where, params = ("WHERE l.id < %s", [before_id]) if before_id is not None else ("", [])
+    return query_df(f"""
+        SELECT l.id, l.date_heure, u.username, l.module, l.action
+        FROM logs_acces l
+        JOIN utilisateurs u ON l.user_id = u.id
+        {where}
+        ORDER BY l.id DESC
+        LIMIT %s
+    """, params + [LOGS_PAGE_SIZE])
+
+# TTL de secours : le cache est normalement invalidé par start_pending_orders_listener()
+@st.cache_data(ttl=60, show_spinner=False)
 def get_pending_orders_count():
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM commandes WHERE statut = 'En attente'")
-        count = c.fetchone()[0]
-        return count
-    finally:
-        release_connection(conn)
+    with db_cursor() as c:
+        c.execute("EXECUTE pending_orders_count_p")
+        return c.fetchone()[0]
+
+@st.cache_resource
+def start_pending_orders_listener():
+    """Thread (un par processus) qui écoute 'commandes_changed' et recalcule le compteur des commandes en attente"""
+    def listen():
+        while True:
+            conn = None
+            try:
+                # Connexion dédiée hors pool : l'écoute permanente n'occupe aucune place du pool
+                conn = psycopg2.connect(**get_connection_params())
+                conn.autocommit = True
+                conn.cursor().execute("LISTEN commandes_changed")
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        get_pending_orders_count.clear()
+                        # Recalcul immédiat en arrière-plan : le prochain rendu lit le cache au lieu d'attendre le COUNT.
+                        # Une erreur ici ne doit pas couper l'écoute (le cache reste simplement vidé)
+                        try:
+                            get_pending_orders_count()
+                        except Exception as e:
+                            print(f"Erreur recalcul compteur commandes en attente: {e}")
+            except Exception as e:
+                print(f"Erreur écoute LISTEN/NOTIFY: {e}")
+                if conn:
+                    conn.close()
+                time.sleep(5)
+
+    thread = threading.Thread(target=listen, name="pending-orders-listener", daemon=True)
+    thread.start()
+    return thread
+
+# Rafraîchissement du badge seul (fragment) : pas de rerun de toute la page
+PENDING_BADGE_REFRESH = "10s"
+
+@st.fragment(run_every=PENDING_BADGE_REFRESH)
+def render_pending_orders_badge():
+    """Badge des commandes en attente ; le compteur est en cache, invalidé par LISTEN/NOTIFY"""
+    pending_count = get_pending_orders_count()
+    if pending_count > 0:
+        st.error(f"🔔 **{pending_count} NOUVELLE(S) COMMANDE(S)** en attente de validation!")
+
+@st.cache_data(ttl=10, show_spinner=False)
+def get_dashboard_metrics():
+    """Retourne (nb_clients, nb_produits, nb_commandes, ca_total, nb_stock_faible, commandes_par_statut)
+    en une seule requête"""
+    with db_cursor() as c:
+        c.execute("""
+            SELECT (SELECT COUNT(*) FROM clients),
+                   (SELECT COUNT(*) FROM produits),
+                   (SELECT COUNT(*) FROM commandes),
+                   (SELECT COALESCE(SUM(c.quantite * p.prix), 0)
+                    FROM commandes c JOIN produits p ON c.produit_id = p.id),
+                   (SELECT COUNT(*) FROM produits WHERE stock <= seuil_alerte),
+                   (SELECT json_object_agg(statut, nb)
+                    FROM (SELECT statut, COUNT(*) AS nb FROM commandes
+                          WHERE statut IS NOT NULL GROUP BY statut) s)
+        """)
+        nb_clients, nb_produits, nb_commandes, ca_total, nb_stock_faible, par_statut = c.fetchone()
+        return (int(nb_clients), int(nb_produits), int(nb_commandes), float(ca_total), int(nb_stock_faible),
+                par_statut or {})
+
+# Nombre de barres du graphique de stock : le catalogue entier ne traverse plus le réseau
+PRODUITS_CHART_LIMIT = 50
+
+@st.cache_data(ttl=10, show_spinner=False)
+def get_produits_chart():
+    """Niveaux de stock (nom, stock) des produits les plus proches de leur seuil d'alerte, pour le graphique du tableau de bord"""
+    return query_df("SELECT nom, stock FROM produits ORDER BY stock - seuil_alerte, id LIMIT %s", [PRODUITS_CHART_LIMIT])
+
+SESSION_SWEEP_PROBABILITY = 0.01
 
 def save_session_to_db(user_id, username, role):
-    conn = get_connection()
-    try:
-        c = conn.cursor()
-        import time
-        session_id = hashlib.sha256(f"{username}_{time.time()}".encode()).hexdigest()
+    with db_cursor() as c:
+        # Identifiant aléatoire (CSPRNG), imprévisible contrairement à un hash du nom et de l'heure
+        session_id = secrets.token_urlsafe(32)
         
-        c.execute("DELETE FROM sessions WHERE last_activity < NOW() - INTERVAL '1 day'")
+        # Purge des sessions expirées amortie : ~1 connexion sur 100 seulement
+        if random.random() < SESSION_SWEEP_PROBABILITY:
+            c.execute("DELETE FROM sessions WHERE last_activity < NOW() - INTERVAL '1 day'")
         
-        c.execute("""INSERT INTO sessions (session_id, user_id, username, role, last_activity) 
-                     VALUES (%s, %s, %s, %s, NOW())
-                     ON CONFLICT (session_id) DO UPDATE SET last_activity = NOW()""",
-                  (session_id, user_id, username, role))
-        conn.commit()
+        c.execute("EXECUTE save_session_p (%s, %s, %s, %s)", (session_id, user_id, username, role))
         return session_id
-    finally:
-        release_connection(conn)
 
 def load_session_from_db(session_id):
     """Charge une session depuis la base de données avec gestion d'erreur"""
     try:
-        conn = get_connection()
-        try:
-            c = conn.cursor()
-            c.execute("""SELECT user_id, username, role FROM sessions 
-                         WHERE session_id=%s AND last_activity > NOW() - INTERVAL '1 day'""",
-                      (session_id,))
-            result = c.fetchone()
-            
-            if result:
-                c.execute("UPDATE sessions SET last_activity=NOW() WHERE session_id=%s", (session_id,))
-                conn.commit()
-            return result
-        finally:
-            release_connection(conn)
+        with db_cursor() as c:
+            # Validation et rafraîchissement de last_activity en un seul aller-retour
+            c.execute("EXECUTE load_session_p (%s)", (session_id,))
+            return c.fetchone()
     except Exception as e:
         # En cas d'erreur de connexion, retourner None pour forcer une nouvelle connexion
         print(f"Erreur chargement session: {e}")
         return None
 
 def delete_session_from_db(session_id):
-    conn = get_connection()
+    with db_cursor() as c:
+        c.execute("EXECUTE delete_session_p (%s)", (session_id,))
+
+# Jetons de session signés (HMAC) : pendant SESSION_TOKEN_MAX_AGE secondes après son émission,
+# le jeton suffit à restaurer la session. Au-delà, la base est consultée (load_session_from_db) :
+# cela fait glisser last_activity et refuse les sessions déconnectées ou supprimées, puis le jeton est re-signé
+SESSION_TOKEN_MAX_AGE = 300
+
+@st.cache_resource
+def get_session_secret():
+    """Clé HMAC des jetons de session (aléatoire par processus si non configurée)"""
+    secret = os.getenv('SESSION_SECRET')
+    if not secret:
+        try:
+            secret = st.secrets["session"]["secret"]
+        except Exception:
+            secret = secrets.token_hex(32)
+    return secret.encode()
+
+def sign_session_token(session_id, user_id, username, role):
+    """Jeton transporté dans l'URL : données de session + date d'émission, signés"""
+    payload = json.dumps([session_id, user_id, username, role, int(time.time())])
+    payload_b64 = base64.urlsafe_b64encode(payload.encode()).decode()
+    signature = hmac.new(get_session_secret(), payload_b64.encode(), hashlib.sha256).hexdigest()
+    return f"{payload_b64}.{signature}"
+
+def parse_session_token(token):
+    """Retourne (session_id, (user_id, username, role)) ; le second élément vaut None
+    si la signature est invalide ou si le jeton a plus de SESSION_TOKEN_MAX_AGE secondes
+    (la base doit alors être consultée)"""
     try:
-        c = conn.cursor()
-        c.execute("DELETE FROM sessions WHERE session_id=%s", (session_id,))
-        conn.commit()
-    finally:
-        release_connection(conn)
+        payload_b64, signature = token.rsplit('.', 1)
+        payload = base64.urlsafe_b64decode(payload_b64.encode()).decode()
+        session_id, user_id, username, role, issued = json.loads(payload)
+    except (ValueError, TypeError):
+        # Ancien format : identifiant de session brut
+        return token, None
+    expected = hmac.new(get_session_secret(), payload_b64.encode(), hashlib.sha256).hexdigest()
+    if hmac.compare_digest(signature.encode(), expected.encode()) and time.time() - issued < SESSION_TOKEN_MAX_AGE:
+        return session_id, (user_id, username, role)
+    return session_id, None
 
 # ========== FONCTION DE COMMANDE PUBLIQUE ==========
 def page_passer_commande_publique():
     st.title("🛍️ Passer une Nouvelle Commande (Espace Client)")
     st.markdown("---")
     
-    # Forcer le rechargement des produits (pas de cache)
-    conn = get_connection()
-    try:
-        produits = pd.read_sql_query("SELECT * FROM produits WHERE stock > 0 ORDER BY nom", conn)
-    finally:
-        release_connection(conn)
+    # Forcer le rechargement des produits (pas de cache), seulement les colonnes utiles au formulaire.
+    # Quelques lignes parcourues une fois : des tuples suffisent, pas besoin d'un DataFrame
+    with db_cursor() as c:
+        c.execute("SELECT id, nom, prix, stock FROM produits WHERE stock > 0 ORDER BY nom")
+        produits = c.fetchall()
     
-    if produits.empty:
+    if not produits:
         st.warning("⚠️ Service temporairement indisponible (aucun produit en vente).")
         return
 
@@ -573,11 +997,12 @@ def page_passer_commande_publique():
     
     st.subheader("2. Votre Commande")
     
-    # Créer une liste neutre de produits
-    produits_options = ["-- Sélectionner un produit --"] + [
-        f"{row['nom']} (Prix: {row['prix']:.2f} € - Stock disponible: {row['stock']})" 
-        for _, row in produits.iterrows()
-    ]
+    # Créer une liste neutre de produits (libellé -> ligne produit)
+    produits_par_libelle = {
+        f"{nom} (Prix: {prix:.2f} € - Stock disponible: {stock})": (id_produit, nom, prix, stock)
+        for id_produit, nom, prix, stock in produits
+    }
+    produits_options = ["-- Sélectionner un produit --"] + list(produits_par_libelle)
     
     selected_product_label = st.selectbox(
         "Produit *", 
@@ -591,12 +1016,11 @@ def page_passer_commande_publique():
     quantite = 1
 
     if selected_product_label and selected_product_label != "-- Sélectionner un produit --":
-        # Extraire le nom du produit de la sélection
-        nom_produit = selected_product_label.split(" (Prix:")[0]
-        produit_data = produits[produits['nom'] == nom_produit].iloc[0]
-        produit_id = int(produit_data['id'])
-        stock_disponible = int(produit_data['stock'])
-        prix = float(produit_data['prix'])
+        # Retrouver le produit de la sélection
+        produit_id, nom_produit, prix, stock_disponible = produits_par_libelle[selected_product_label]
+        produit_id = int(produit_id)
+        stock_disponible = int(stock_disponible)
+        prix = float(prix)
         
         # Vérifier si le produit a changé pour reset la quantité
         if st.session_state.produit_selectionne != produit_id:
@@ -661,50 +1085,54 @@ def page_passer_commande_publique():
             st.error("❌ La quantité doit être au moins 1.")
             return
 
-        conn = get_connection()
         try:
-            c = conn.cursor()
+            quantite_finale = int(st.session_state.quantite_cmd_publique)
+            with db_cursor() as c:
+                # Recherche ou création du client, contrôle du stock et création de la commande
+                # (SANS décrément du stock, fait à la validation) en une seule requête
+                c.execute("""
+                    WITH existant AS (
+                        SELECT id FROM clients WHERE LOWER(email) = LOWER(%(email)s) ORDER BY id LIMIT 1
+                    ), nouveau AS (
+                        INSERT INTO clients (nom, email, telephone, date_creation)
+                        SELECT %(nom)s, %(email)s, %(tel)s, CURRENT_DATE
+                        WHERE NOT EXISTS (SELECT 1 FROM existant)
+                        RETURNING id
+                    ), client AS (
+                        SELECT id, FALSE AS cree FROM existant
+                        UNION ALL
+                        SELECT id, TRUE FROM nouveau
+                    ), commande AS (
+                        INSERT INTO commandes (client_id, produit_id, quantite, date, statut)
+                        SELECT client.id, p.id, %(quantite)s, CURRENT_DATE, 'En attente'
+                        FROM client, produits p
+                        WHERE p.id = %(produit_id)s AND p.stock >= %(quantite)s
+                        RETURNING id
+                    )
+                    SELECT client.cree, (SELECT id FROM commande),
+                           (SELECT stock FROM produits WHERE id = %(produit_id)s)
+                    FROM client
+                """, {'nom': nom_saisi, 'email': email_saisi, 'tel': tel_saisi if tel_saisi else None,
+                      'quantite': quantite_finale, 'produit_id': produit_id})
+                client_cree, nouvelle_commande_id, stock_actuel = c.fetchone()
             
-            # Vérifier si le client existe
-            c.execute("SELECT id FROM clients WHERE LOWER(email) = LOWER(%s)", (email_saisi,))
-            client_data = c.fetchone()
+            stock_result = stock_actuel is not None
+            current_stock = int(stock_actuel) if stock_result else 0
             
-            if client_data:
-                client_id = int(client_data[0])
-                st.info(f"✅ Client reconnu : {nom_saisi}")
-            else:
-                # Créer le nouveau client
+            if client_cree:
                 st.info(f"🆕 Nouveau client : création du compte pour {nom_saisi}")
-                c.execute("""INSERT INTO clients (nom, email, telephone, date_creation) 
-                            VALUES (%s, %s, %s, CURRENT_DATE) RETURNING id""",
-                          (nom_saisi, email_saisi, tel_saisi if tel_saisi else None))
-                client_id = int(c.fetchone()[0])
-                conn.commit()  # Commit immédiat
-                
+            else:
+                st.info(f"✅ Client reconnu : {nom_saisi}")
+            
+            if client_cree:
                 # Invalider le cache clients
                 get_clients.clear()
-            
-            # Vérifier le stock une dernière fois
-            c.execute("SELECT stock FROM produits WHERE id = %s", (produit_id,))
-            stock_result = c.fetchone()
+                get_dashboard_metrics.clear()
+                count_rows.clear()
             
             if not stock_result:
                 st.error("❌ Produit introuvable.")
-                conn.rollback()
-                return
-                
-            current_stock = int(stock_result[0])
-            quantite_finale = int(st.session_state.quantite_cmd_publique)
-            
-            if current_stock >= quantite_finale:
-                # Créer la commande SANS décrémenter le stock
-                c.execute("""INSERT INTO commandes (client_id, produit_id, quantite, date, statut) 
-                            VALUES (%s, %s, %s, CURRENT_DATE, 'En attente') RETURNING id""",
-                          (client_id, produit_id, quantite_finale))
-                
-                nouvelle_commande_id = c.fetchone()[0]
-                conn.commit()
-                
+            elif nouvelle_commande_id is not None:
                 st.success(f"✅ Commande envoyée avec succès !")
                 st.success(f"📋 N° de commande : **#{nouvelle_commande_id}**")
                 st.success(f"💰 Montant estimé : **{montant_estime:.2f} €**")
@@ -715,7 +1143,7 @@ def page_passer_commande_publique():
                     st.divider()
                     with st.spinner("📧 Envoi de l'email de confirmation..."):
                         # Récupérer le nom du produit
-                        nom_produit_complet = produits[produits['id'] == produit_id]['nom'].iloc[0]
+                        nom_produit_complet = nom_produit
                         
                         sujet = f"SYGEP - Confirmation de réception de votre commande #{nouvelle_commande_id}"
                         corps_html = generer_email_confirmation_commande(
@@ -742,7 +1170,10 @@ def page_passer_commande_publique():
                 
                 # Invalider les caches
                 get_pending_orders_count.clear()
+                get_clients.clear()
                 get_commandes.clear()
+                get_dashboard_metrics.clear()
+                count_rows.clear()
                 
                 # Reset session state
                 st.session_state.quantite_cmd_publique = 1
@@ -755,20 +1186,30 @@ def page_passer_commande_publique():
                     del st.session_state.email_client_public
                 if "tel_client_public" in st.session_state:
                     del st.session_state.tel_client_public
-                
             else:
-                conn.rollback()
                 st.error(f"❌ Stock insuffisant ! Disponible: {current_stock}, Demandé: {quantite_finale}")
             
         except Exception as e:
-            conn.rollback()
             st.error(f"❌ Une erreur est survenue: {str(e)}")
-        finally:
-            release_connection(conn)
 
 
+@st.cache_resource
+def load_logo():
+    """Logo décodé une seule fois par processus (None si le fichier est absent)"""
+    if os.path.exists("Logo_ofppt.png"):
+        from PIL import Image  # Import différé : Pillow n'est chargé que si un logo est présent
+        logo = Image.open("Logo_ofppt.png")
+        logo.load()
+        return logo
+    return None
+
 # ========== INITIALISATION ==========
-init_database()
+try:
+    init_database_once()
+except RuntimeError:
+    pass  # Erreur déjà affichée par init_database(), nouvelle tentative au prochain rerun
+
+start_pending_orders_listener()
 
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -776,13 +1217,18 @@ if 'logged_in' not in st.session_state:
     st.session_state.user_id = None
     st.session_state.role = None
     st.session_state.permissions = {}
+    st.session_state.access_set = frozenset()
     st.session_state.session_id = None
 
 if not st.session_state.logged_in:
     query_params = st.query_params
     if 'session_id' in query_params:
-        session_id = query_params['session_id']
-        session_data = load_session_from_db(session_id)
+        session_id, session_data = parse_session_token(query_params['session_id'])
+        if not session_data:
+            session_data = load_session_from_db(session_id)
+            if session_data:
+                # Re-signer : les chargements des 5 prochaines minutes se passent de la base
+                st.query_params['session_id'] = sign_session_token(session_id, *session_data)
         
         if session_data:
             user_id, username, role = session_data
@@ -791,6 +1237,7 @@ if not st.session_state.logged_in:
             st.session_state.user_id = user_id
             st.session_state.role = role
             st.session_state.permissions = get_user_permissions(user_id)
+            st.session_state.access_set = get_access_set(st.session_state.permissions)
             st.session_state.session_id = session_id
 
 # ========== PAGE DE CONNEXION / COMMANDE PUBLIQUE ==========
@@ -799,8 +1246,8 @@ if not st.session_state.logged_in:
     
     with col1:
         try:
-            if os.path.exists("Logo_ofppt.png"):
-                logo = Image.open("Logo_ofppt.png")
+            logo = load_logo()
+            if logo is not None:
                 st.image(logo, width=150)
         except:
             st.write("🎓")
@@ -847,18 +1294,19 @@ if not st.session_state.logged_in:
                 if submit:
                     result = verify_login(username, password)
                     if result:
-                        user_id, role = result
+                        user_id, role, permissions = result
                         session_id = save_session_to_db(user_id, username, role)
                         
                         st.session_state.logged_in = True
                         st.session_state.username = username
                         st.session_state.user_id = user_id
                         st.session_state.role = role
-                        st.session_state.permissions = get_user_permissions(user_id)
+                        st.session_state.permissions = permissions
+                        st.session_state.access_set = get_access_set(permissions)
                         st.session_state.session_id = session_id
                         
                         log_access(user_id, "connexion", "Connexion réussie")
-                        st.query_params['session_id'] = session_id
+                        st.query_params['session_id'] = sign_session_token(session_id, user_id, username, role)
                         
                         st.success("✅ Connexion réussie !")
                         st.info("💡 Votre session est maintenant persistante.")
@@ -878,8 +1326,8 @@ col_logo, col_titre, col_date = st.columns([1, 4, 1])
 
 with col_logo:
     try:
-        if os.path.exists("Logo_ofppt.png"):
-            logo = Image.open("Logo_ofppt.png")
+        logo = load_logo()
+        if logo is not None:
             st.image(logo, width=100)
     except:
         st.write("🎓")
@@ -919,17 +1367,16 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-pending_count = get_pending_orders_count()
-if pending_count > 0:
-    st.sidebar.error(f"🔔 **{pending_count} NOUVELLE(S) COMMANDE(S)** en attente de validation!")
+with st.sidebar:
+    render_pending_orders_badge()
 
 if st.session_state.role != "admin":
     with st.sidebar.expander("🔑 Mes Permissions"):
-        for module, perms in st.session_state.permissions.items():
-            icon = "✅" if perms['lecture'] or perms['ecriture'] else "❌"
-            lecture = "📖" if perms['lecture'] else ""
-            ecriture = "✏️" if perms['ecriture'] else ""
-            st.write(f"{icon} **{module.replace('_', ' ').title()}** {lecture} {ecriture}")
+        # Un seul élément Markdown pour toute la liste (rendu à chaque rerun)
+        st.markdown("\n\n".join(
+            f"{'✅' if perms['lecture'] or perms['ecriture'] else '❌'} **{module.replace('_', ' ').title()}** "
+            f"{'📖' if perms['lecture'] else ''} {'✏️' if perms['ecriture'] else ''}"
+            for module, perms in st.session_state.permissions.items()))
 
 if st.sidebar.button("🚪 Se déconnecter", use_container_width=True):
     log_access(st.session_state.user_id, "deconnexion", "Déconnexion")
@@ -946,7 +1393,6 @@ st.sidebar.divider()
 st.sidebar.markdown("### 🧭 Navigation")
 
 # Construction des options de menu avec emojis
-menu_options = []
 menu_icons = {
     "Tableau de Bord": "📈",
     "Gestion des Clients": "👥",
@@ -959,22 +1405,19 @@ menu_icons = {
     "À Propos": "ℹ️"
 }
 
-if has_access("tableau_bord"): 
-    menu_options.append("Tableau de Bord")
-if has_access("clients"): 
-    menu_options.append("Gestion des Clients")
-if has_access("produits"): 
-    menu_options.append("Gestion des Produits")
-if has_access("fournisseurs"): 
-    menu_options.append("Gestion des Fournisseurs")
-if has_access("commandes"): 
-    menu_options.append("Gestion des Commandes")
-if has_access("achats"): 
-    menu_options.append("Gestion des Achats")
-if has_access("rapports"): 
-    menu_options.append("Rapports & Exports")
-if has_access("utilisateurs"): 
-    menu_options.append("Gestion des Utilisateurs")
+menu_modules = [
+    ("tableau_bord", "Tableau de Bord"),
+    ("clients", "Gestion des Clients"),
+    ("produits", "Gestion des Produits"),
+    ("fournisseurs", "Gestion des Fournisseurs"),
+    ("commandes", "Gestion des Commandes"),
+    ("achats", "Gestion des Achats"),
+    ("rapports", "Rapports & Exports"),
+    ("utilisateurs", "Gestion des Utilisateurs"),
+]
+
+# Accès précalculés à la connexion : un test d'appartenance par entrée
+menu_options = [label for module, label in menu_modules if has_access(module)]
 menu_options.append("À Propos")
 
 # Créer les labels avec emojis pour le radio
@@ -1019,23 +1462,19 @@ if menu == "Tableau de Bord":
     if pending_count > 0:
         st.error(f"🔔 **URGENT : {pending_count} NOUVELLE(S) COMMANDE(S) CLIENT EN ATTENTE !**")
     
-    produits_alerte = get_produits_stock_faible()
-    if not produits_alerte.empty:
-        st.warning(f"⚠️ **{len(produits_alerte)} produit(s) en stock faible !**")
+    nb_clients, nb_produits, nb_commandes, ca_total, nb_stock_faible, commandes_par_statut = get_dashboard_metrics()
+    if nb_stock_faible > 0:
+        st.warning(f"⚠️ **{nb_stock_faible} produit(s) en stock faible !**")
     
     col1, col2, col3, col4 = st.columns(4)
-    clients = get_clients()
-    produits = get_produits()
-    commandes = get_commandes()
     
     with col1:
-        st.metric("👥 Clients", len(clients))
+        st.metric("👥 Clients", nb_clients)
     with col2:
-        st.metric("📦 Produits", len(produits))
+        st.metric("📦 Produits", nb_produits)
     with col3:
-        st.metric("🛒 Commandes", len(commandes))
+        st.metric("🛒 Commandes", nb_commandes)
     with col4:
-        ca_total = commandes['montant'].sum() if not commandes.empty else 0
         st.metric("💰 CA Total", f"{ca_total:.2f} €")
     
     st.divider()
@@ -1043,13 +1482,15 @@ if menu == "Tableau de Bord":
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("📦 Niveau de Stock")
-        if not produits.empty:
-            st.bar_chart(produits.set_index('nom')['stock'])
+        produits_chart = get_produits_chart()
+        if not produits_chart.empty:
+            st.bar_chart(produits_chart.set_index('nom')['stock'])
     
     with col2:
         st.subheader("📊 Statut des Commandes")
-        if not commandes.empty:
-            st.bar_chart(commandes['statut'].value_counts())
+        # Décompte par statut calculé en base : aucune commande n'est rapatriée
+        if commandes_par_statut:
+            st.bar_chart(pd.Series(commandes_par_statut).sort_values(ascending=False))
 
 # ========== GESTION DES CLIENTS ==========
 elif menu == "Gestion des Clients":
@@ -1060,52 +1501,53 @@ elif menu == "Gestion des Clients":
     log_access(st.session_state.user_id, "clients", "Consultation")
     st.header("👥 Gestion des Clients")
     
+    peut_ecrire = has_access("clients", "ecriture")
     tab1, tab2, tab3 = st.tabs(["📋 Liste", "➕ Ajouter", "✏️ Modifier"])
     
     with tab1:
-        clients = get_clients()
+        recherche = st.text_input("🔍 Rechercher un client (nom, email)", key="search_clients").strip()
+        offset = render_pagination("clients", recherche)
+        clients = get_clients(limit=PAGE_SIZE, offset=offset, search=recherche)
+        libelles_clients = {i: f"{n} - {m}" for i, n, m in zip(clients['id'].tolist(), clients['nom'].tolist(), clients['email'].tolist())}
         if not clients.empty:
             st.dataframe(clients, use_container_width=True, hide_index=True)
             
-            if has_access("clients", "ecriture"):
+            if peut_ecrire:
                 st.divider()
                 st.subheader("🗑️ Supprimer un Client")
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     client_id = st.selectbox("Sélectionner le client à supprimer", clients['id'].tolist(),
-                                            format_func=lambda x: f"{clients[clients['id']==x]['nom'].iloc[0]} - {clients[clients['id']==x]['email'].iloc[0]}")
+                                            format_func=libelles_clients.get)
                 with col2:
                     st.write("")
                     st.write("")
                     if st.button("🗑️ Supprimer", type="secondary"):
-                        conn = get_connection()
                         try:
-                            c = conn.cursor()
-                            
-                            c.execute("SELECT COUNT(*) FROM commandes WHERE client_id=%s", (int(client_id),))
-                            nb_commandes = c.fetchone()[0]
+                            with db_cursor() as c:
+                                c.execute("SELECT COUNT(*) FROM commandes WHERE client_id=%s", (int(client_id),))
+                                nb_commandes = c.fetchone()[0]
+                                if nb_commandes == 0:
+                                    c.execute("DELETE FROM clients WHERE id=%s", (int(client_id),))
                             
                             if nb_commandes > 0:
                                 st.error(f"❌ Impossible de supprimer ce client !\n\n"
                                         f"Il possède {nb_commandes} commande(s) enregistrée(s).\n\n"
                                         f"💡 Supprimez d'abord ses commandes ou archivez le client.")
                             else:
-                                c.execute("DELETE FROM clients WHERE id=%s", (int(client_id),))
-                                conn.commit()
                                 log_access(st.session_state.user_id, "clients", f"Suppression ID:{client_id}")
                                 st.success("✅ Client supprimé avec succès!")
                                 get_clients.clear()
+                                get_dashboard_metrics.clear()
+                                count_rows.clear()
                                 st.rerun()
                         except Exception as e:
-                            conn.rollback()
                             st.error(f"❌ Erreur technique: {e}")
-                        finally:
-                            release_connection(conn)
         else:
             st.info("📭 Aucun client enregistré")
     
     with tab2:
-        if not has_access("clients", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Vous n'avez pas les droits d'écriture sur ce module")
         else:
             st.subheader("➕ Ajouter un Nouveau Client")
@@ -1122,37 +1564,35 @@ elif menu == "Gestion des Clients":
                 
                 if submit:
                     if nom and email:
-                        conn = get_connection()
                         try:
-                            c = conn.cursor()
-                            c.execute("INSERT INTO clients (nom, email, telephone, date_creation) VALUES (%s, %s, %s, CURRENT_DATE)",
-                                      (nom, email, telephone if telephone else None))
-                            conn.commit()
+                            with db_cursor() as c:
+                                c.execute("EXECUTE ajouter_client_p (%s, %s, %s)",
+                                          (nom, email, telephone if telephone else None))
                             log_access(st.session_state.user_id, "clients", f"Ajout: {nom}")
                             st.success(f"✅ Client '{nom}' ajouté avec succès!")
                             get_clients.clear()
+                            get_dashboard_metrics.clear()
+                            count_rows.clear()
                             st.rerun()
                         except Exception as e:
-                            conn.rollback()
                             st.error(f"❌ Erreur: {e}")
-                        finally:
-                            release_connection(conn)
                     else:
                         st.error("❌ Le nom et l'email sont obligatoires")
     
     with tab3:
-        if not has_access("clients", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Vous n'avez pas les droits d'écriture sur ce module")
         else:
             st.subheader("✏️ Modifier un Client")
             clients = get_clients()
+            noms_clients = dict(zip(clients['id'].tolist(), clients['nom'].tolist()))
             
             if clients.empty:
                 st.info("📭 Aucun client à modifier")
             else:
                 client_id_update = st.selectbox("Sélectionner le client à modifier", 
                                                clients['id'].tolist(),
-                                               format_func=lambda x: f"{clients[clients['id']==x]['nom'].iloc[0]}")
+                                               format_func=noms_clients.get)
                 
                 if client_id_update:
                     client_data = clients[clients['id'] == client_id_update].iloc[0]
@@ -1170,23 +1610,21 @@ elif menu == "Gestion des Clients":
                         
                         if submit_update:
                             if nom_update and email_update:
-                                conn = get_connection()
                                 try:
-                                    c = conn.cursor()
-                                    c.execute("""UPDATE clients 
-                                                SET nom=%s, email=%s, telephone=%s 
-                                                WHERE id=%s""",
-                                              (nom_update, email_update, telephone_update if telephone_update else None, int(client_id_update)))
-                                    conn.commit()
+                                    with db_cursor() as c:
+                                        c.execute("""UPDATE clients 
+                                                    SET nom=%s, email=%s, telephone=%s 
+                                                    WHERE id=%s""",
+                                                  (nom_update, email_update, telephone_update if telephone_update else None, int(client_id_update)))
                                     log_access(st.session_state.user_id, "clients", f"Modification ID:{client_id_update}")
                                     st.success(f"✅ Client '{nom_update}' modifié avec succès!")
                                     get_clients.clear()
+                                    get_commandes.clear()
+                                    get_dashboard_metrics.clear()
+                                    count_rows.clear()
                                     st.rerun()
                                 except Exception as e:
-                                    conn.rollback()
                                     st.error(f"❌ Erreur: {e}")
-                                finally:
-                                    release_connection(conn)
                             else:
                                 st.error("❌ Le nom et l'email sont obligatoires")
 
@@ -1199,67 +1637,107 @@ elif menu == "Gestion des Produits":
     log_access(st.session_state.user_id, "produits", "Consultation")
     st.header("📦 Gestion des Produits")
     
+    peut_ecrire = has_access("produits", "ecriture")
     tab1, tab2, tab3 = st.tabs(["📋 Liste", "➕ Ajouter", "✏️ Modifier"])
     
     with tab1:
-        produits = get_produits()
+        recherche = st.text_input("🔍 Rechercher un produit", key="search_produits").strip()
+        offset = render_pagination("produits", recherche)
+        produits = get_produits(limit=PAGE_SIZE, offset=offset, search=recherche)
+        noms_produits = dict(zip(produits['id'].tolist(), produits['nom'].tolist()))
         if not produits.empty:
             produits_display = produits.copy()
-            produits_display['statut'] = produits_display.apply(
-                lambda r: '🔴 Stock Faible' if r['stock'] <= r['seuil_alerte'] else '🟢 Stock OK', axis=1)
+            produits_display['statut'] = np.where(
+                produits_display['stock'].to_numpy() <= produits_display['seuil_alerte'].to_numpy(),
+                '🔴 Stock Faible', '🟢 Stock OK')
             st.dataframe(produits_display, use_container_width=True, hide_index=True)
             
-            if has_access("produits", "ecriture"):
+            if peut_ecrire:
                 st.divider()
                 col1, col2 = st.columns(2)
                 
                 with col1:
                     st.subheader("📝 Ajuster le Stock")
-                    col_a, col_b, col_c = st.columns(3)
-                    with col_a:
-                        prod_id = st.selectbox("Produit", produits['id'].tolist(),
-                                              format_func=lambda x: produits[produits['id']==x]['nom'].iloc[0])
-                    with col_b:
-                        ajust = st.number_input("Ajustement", value=0, step=1, 
-                                               help="Nombre positif pour ajouter, négatif pour retirer")
-                    with col_c:
-                        st.write("")
-                        st.write("")
-                        if st.button("✅ Appliquer"):
-                            conn = get_connection()
+                    # Fragment : saisir l'ajustement ne réexécute que ce bloc, pas toute la page
+                    @st.fragment
+                    def ajuster_stock():
+                        col_a, col_b, col_c = st.columns(3)
+                        with col_a:
+                            prod_id = st.selectbox("Produit", produits['id'].tolist(),
+                                                  format_func=noms_produits.get)
+                        with col_b:
+                            ajust = st.number_input("Ajustement", value=0, step=1, 
+                                                   help="Nombre positif pour ajouter, négatif pour retirer")
+                        with col_c:
+                            st.write("")
+                            st.write("")
+                            if st.button("✅ Appliquer") and not is_double_submit("ajuster_stock", prod_id, ajust):
+                                try:
+                                    with db_cursor() as c:
+                                        c.execute("EXECUTE ajuster_stock_p (%s, %s)", (int(ajust), int(prod_id)))
+                                    log_access(st.session_state.user_id, "produits", f"Ajustement stock ID:{prod_id} ({ajust:+d})")
+                                    st.success(f"✅ Stock ajusté de {ajust:+d}")
+                                    get_produits.clear()
+                                    get_produits_chart.clear()
+                                    get_dashboard_metrics.clear()
+                                    count_rows.clear()
+                                    st.rerun()
+                                except Exception as e:
+                                    st.error(f"❌ Erreur: {e}")
+                    ajuster_stock()
+                
+                    with st.expander("📦 Ajustement en lot"):
+                        lignes_lot = st.text_area("Une ligne par produit : ID;ajustement", placeholder="12;+5\n7;-2", key="ajust_lot")
+                        if st.button("✅ Appliquer le lot") and not is_double_submit("ajuster_stock_lot", lignes_lot):
                             try:
-                                c = conn.cursor()
-                                c.execute("UPDATE produits SET stock = stock + %s WHERE id = %s", (int(ajust), int(prod_id)))
-                                conn.commit()
-                                log_access(st.session_state.user_id, "produits", f"Ajustement stock ID:{prod_id} ({ajust:+d})")
-                                st.success(f"✅ Stock ajusté de {ajust:+d}")
-                                get_produits.clear()
-                                st.rerun()
+                                ajustements = {}
+                                for ligne in lignes_lot.splitlines():
+                                    if ligne.strip():
+                                        pid, qte = ligne.split(";")
+                                        ajustements[int(pid)] = ajustements.get(int(pid), 0) + int(qte)
+                                
+                                if not ajustements:
+                                    st.warning("⚠️ Aucun ajustement saisi")
+                                else:
+                                    # Un seul UPDATE pour tout le lot au lieu d'un aller-retour par produit
+                                    with db_cursor() as c:
+                                        execute_values(c, """UPDATE produits SET stock = produits.stock + v.ajust
+                                                             FROM (VALUES %s) AS v(id, ajust)
+                                                             WHERE produits.id = v.id""",
+                                                       list(ajustements.items()), page_size=len(ajustements))
+                                        nb_maj = c.rowcount
+                                    log_access(st.session_state.user_id, "produits", f"Ajustement stock en lot: {nb_maj} produit(s)")
+                                    st.success(f"✅ {nb_maj} produit(s) ajusté(s)")
+                                    get_produits.clear()
+                                    get_produits_chart.clear()
+                                    get_dashboard_metrics.clear()
+                                    count_rows.clear()
+                                    st.rerun()
+                            except ValueError:
+                                st.error("❌ Format attendu : ID;ajustement (nombres entiers)")
                             except Exception as e:
-                                conn.rollback()
                                 st.error(f"❌ Erreur: {e}")
-                            finally:
-                                release_connection(conn)
-                
+                    
                 with col2:
                     st.subheader("🗑️ Supprimer un Produit")
                     col_x, col_y = st.columns([3, 1])
                     with col_x:
                         prod_del_id = st.selectbox("Produit à supprimer", produits['id'].tolist(),
-                                                  format_func=lambda x: f"{produits[produits['id']==x]['nom'].iloc[0]}")
+                                                  format_func=noms_produits.get)
                     with col_y:
                         st.write("")
                         st.write("")
                         if st.button("🗑️ Supprimer", type="secondary"):
-                            conn = get_connection()
                             try:
-                                c = conn.cursor()
-                                
-                                c.execute("SELECT COUNT(*) FROM commandes WHERE produit_id=%s", (int(prod_del_id),))
-                                nb_commandes = c.fetchone()[0]
-                                
-                                c.execute("SELECT COUNT(*) FROM achats WHERE produit_id=%s", (int(prod_del_id),))
-                                nb_achats = c.fetchone()[0]
+                                with db_cursor() as c:
+                                    c.execute("SELECT COUNT(*) FROM commandes WHERE produit_id=%s", (int(prod_del_id),))
+                                    nb_commandes = c.fetchone()[0]
+                                    
+                                    c.execute("SELECT COUNT(*) FROM achats WHERE produit_id=%s", (int(prod_del_id),))
+                                    nb_achats = c.fetchone()[0]
+                                    
+                                    if nb_commandes == 0 and nb_achats == 0:
+                                        c.execute("DELETE FROM produits WHERE id=%s", (int(prod_del_id),))
                                 
                                 if nb_commandes > 0 or nb_achats > 0:
                                     st.error(f"❌ Impossible de supprimer ce produit !\n\n"
@@ -1268,22 +1746,20 @@ elif menu == "Gestion des Produits":
                                             f"- {nb_achats} achat(s)\n\n"
                                             f"💡 Supprimez d'abord ces enregistrements ou archivez le produit.")
                                 else:
-                                    c.execute("DELETE FROM produits WHERE id=%s", (int(prod_del_id),))
-                                    conn.commit()
                                     log_access(st.session_state.user_id, "produits", f"Suppression ID:{prod_del_id}")
                                     st.success("✅ Produit supprimé!")
                                     get_produits.clear()
+                                    get_produits_chart.clear()
+                                    get_dashboard_metrics.clear()
+                                    count_rows.clear()
                                     st.rerun()
                             except Exception as e:
-                                conn.rollback()
                                 st.error(f"❌ Erreur technique: {e}")
-                            finally:
-                                release_connection(conn)
         else:
             st.info("📭 Aucun produit enregistré")
     
     with tab2:
-        if not has_access("produits", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Vous n'avez pas les droits d'écriture")
         else:
             st.subheader("➕ Ajouter un Nouveau Produit")
@@ -1306,37 +1782,36 @@ elif menu == "Gestion des Produits":
                 
                 if submit:
                     if nom and prix > 0:
-                        conn = get_connection()
                         try:
-                            c = conn.cursor()
-                            c.execute("INSERT INTO produits (nom, prix, stock, seuil_alerte) VALUES (%s, %s, %s, %s)",
-                                      (nom, float(prix), int(stock), int(seuil)))
-                            conn.commit()
+                            with db_cursor() as c:
+                                c.execute("EXECUTE ajouter_produit_p (%s, %s, %s, %s)",
+                                          (nom, float(prix), int(stock), int(seuil)))
                             log_access(st.session_state.user_id, "produits", f"Ajout: {nom}")
                             st.success(f"✅ Produit '{nom}' ajouté!")
                             get_produits.clear()
+                            get_produits_chart.clear()
+                            get_dashboard_metrics.clear()
+                            count_rows.clear()
                             st.rerun()
                         except Exception as e:
-                            conn.rollback()
                             st.error(f"❌ Erreur: {e}")
-                        finally:
-                            release_connection(conn)
                     else:
                         st.error("❌ Nom et prix > 0 requis")
     
     with tab3:
-        if not has_access("produits", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Vous n'avez pas les droits d'écriture")
         else:
             st.subheader("✏️ Modifier un Produit")
             produits = get_produits()
+            noms_produits = dict(zip(produits['id'].tolist(), produits['nom'].tolist()))
             
             if produits.empty:
                 st.info("📭 Aucun produit à modifier")
             else:
                 prod_id_update = st.selectbox("Sélectionner le produit à modifier", 
                                              produits['id'].tolist(),
-                                             format_func=lambda x: f"{produits[produits['id']==x]['nom'].iloc[0]}")
+                                             format_func=noms_produits.get)
                 
                 if prod_id_update:
                     prod_data = produits[produits['id'] == prod_id_update].iloc[0]
@@ -1362,24 +1837,24 @@ elif menu == "Gestion des Produits":
                         
                         if submit_update:
                             if nom_update and prix_update > 0:
-                                conn = get_connection()
                                 try:
-                                    c = conn.cursor()
-                                    c.execute("""UPDATE produits 
-                                                SET nom=%s, prix=%s, stock=%s, seuil_alerte=%s 
-                                                WHERE id=%s""",
-                                              (nom_update, float(prix_update), int(stock_update), 
-                                               int(seuil_update), int(prod_id_update)))
-                                    conn.commit()
+                                    with db_cursor() as c:
+                                        c.execute("""UPDATE produits 
+                                                    SET nom=%s, prix=%s, stock=%s, seuil_alerte=%s 
+                                                    WHERE id=%s""",
+                                                  (nom_update, float(prix_update), int(stock_update), 
+                                                   int(seuil_update), int(prod_id_update)))
                                     log_access(st.session_state.user_id, "produits", f"Modification ID:{prod_id_update}")
                                     st.success(f"✅ Produit '{nom_update}' modifié!")
                                     get_produits.clear()
+                                    get_commandes.clear()
+                                    get_achats.clear()
+                                    get_produits_chart.clear()
+                                    get_dashboard_metrics.clear()
+                                    count_rows.clear()
                                     st.rerun()
                                 except Exception as e:
-                                    conn.rollback()
                                     st.error(f"❌ Erreur: {e}")
-                                finally:
-                                    release_connection(conn)
                             else:
                                 st.error("❌ Nom et prix > 0 requis")
 
@@ -1392,52 +1867,51 @@ elif menu == "Gestion des Fournisseurs":
     log_access(st.session_state.user_id, "fournisseurs", "Consultation")
     st.header("🚚 Gestion des Fournisseurs")
 
+    peut_ecrire = has_access("fournisseurs", "ecriture")
+    # Chargé une seule fois : tous les onglets s'exécutent à chaque rerun
+    fournisseurs = get_fournisseurs()
+    noms_fournisseurs = dict(zip(fournisseurs['id'].tolist(), fournisseurs['nom'].tolist()))
+    
     tab1, tab2, tab3 = st.tabs(["📋 Liste", "➕ Ajouter", "✏️ Modifier"])
 
     with tab1:
-        fournisseurs = get_fournisseurs()
         if not fournisseurs.empty:
             st.dataframe(fournisseurs, use_container_width=True, hide_index=True)
 
-            if has_access("fournisseurs", "ecriture"):
+            if peut_ecrire:
                 st.divider()
                 st.subheader("🗑️ Supprimer un Fournisseur")
                 col1, col2 = st.columns([3, 1])
                 with col1:
                     fournisseur_id = st.selectbox("Sélectionner le fournisseur", fournisseurs['id'].tolist(),
-                                            format_func=lambda x: f"{fournisseurs[fournisseurs['id']==x]['nom'].iloc[0]}")
+                                            format_func=noms_fournisseurs.get)
                 with col2:
                     st.write("")
                     st.write("")
                     if st.button("🗑️ Supprimer", type="secondary"):
-                        conn = get_connection()
                         try:
-                            c = conn.cursor()
-                            
-                            c.execute("SELECT COUNT(*) FROM achats WHERE fournisseur_id=%s", (int(fournisseur_id),))
-                            nb_achats = c.fetchone()[0]
+                            with db_cursor() as c:
+                                c.execute("SELECT COUNT(*) FROM achats WHERE fournisseur_id=%s", (int(fournisseur_id),))
+                                nb_achats = c.fetchone()[0]
+                                if nb_achats == 0:
+                                    c.execute("DELETE FROM fournisseurs WHERE id=%s", (int(fournisseur_id),))
                             
                             if nb_achats > 0:
                                 st.error(f"❌ Impossible de supprimer ce fournisseur !\n\n"
                                         f"Il possède {nb_achats} achat(s) enregistré(s).\n\n"
                                         f"💡 Supprimez d'abord ses achats ou archivez le fournisseur.")
                             else:
-                                c.execute("DELETE FROM fournisseurs WHERE id=%s", (int(fournisseur_id),)) 
-                                conn.commit()
                                 log_access(st.session_state.user_id, "fournisseurs", f"Suppression ID:{fournisseur_id}")
                                 st.success("✅ Fournisseur supprimé!")
                                 get_fournisseurs.clear()
                                 st.rerun()
                         except Exception as e:
-                            conn.rollback()
                             st.error(f"❌ Erreur technique: {e}")
-                        finally:
-                            release_connection(conn)
         else:
             st.info("📭 Aucun fournisseur enregistré")
 
     with tab2:
-        if not has_access("fournisseurs", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Vous n'avez pas les droits d'écriture")
         else:
             st.subheader("➕ Ajouter un Nouveau Fournisseur")
@@ -1455,37 +1929,31 @@ elif menu == "Gestion des Fournisseurs":
                 
                 if submit:
                     if nom:
-                        conn = get_connection()
                         try:
-                            c = conn.cursor()
-                            c.execute("INSERT INTO fournisseurs (nom, email, telephone, adresse, date_creation) VALUES (%s, %s, %s, %s, CURRENT_DATE)",
-                                    (nom, email if email else None, telephone if telephone else None, adresse if adresse else None))
-                            conn.commit()
+                            with db_cursor() as c:
+                                c.execute("INSERT INTO fournisseurs (nom, email, telephone, adresse, date_creation) VALUES (%s, %s, %s, %s, CURRENT_DATE)",
+                                        (nom, email if email else None, telephone if telephone else None, adresse if adresse else None))
                             log_access(st.session_state.user_id, "fournisseurs", f"Ajout: {nom}")
                             st.success(f"✅ Fournisseur '{nom}' ajouté!")
                             get_fournisseurs.clear()
                             st.rerun()
                         except Exception as e:
-                            conn.rollback()
                             st.error(f"❌ Erreur: {e}")
-                        finally:
-                            release_connection(conn)
                     else:
                         st.error("❌ Le nom est obligatoire")
     
     with tab3:
-        if not has_access("fournisseurs", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Vous n'avez pas les droits d'écriture")
         else:
             st.subheader("✏️ Modifier un Fournisseur")
-            fournisseurs = get_fournisseurs()
             
             if fournisseurs.empty:
                 st.info("📭 Aucun fournisseur à modifier")
             else:
                 fournisseur_id_update = st.selectbox("Sélectionner le fournisseur", 
                                                     fournisseurs['id'].tolist(),
-                                                    format_func=lambda x: f"{fournisseurs[fournisseurs['id']==x]['nom'].iloc[0]}")
+                                                    format_func=noms_fournisseurs.get)
                 
                 if fournisseur_id_update:
                     fournisseur_data = fournisseurs[fournisseurs['id'] == fournisseur_id_update].iloc[0]
@@ -1504,27 +1972,24 @@ elif menu == "Gestion des Fournisseurs":
                         
                         if submit_update:
                             if nom_update:
-                                conn = get_connection()
                                 try:
-                                    c = conn.cursor()
-                                    c.execute("""UPDATE fournisseurs 
-                                                SET nom=%s, email=%s, telephone=%s, adresse=%s 
-                                                WHERE id=%s""",
-                                              (nom_update, 
-                                               email_update if email_update else None, 
-                                               telephone_update if telephone_update else None,
-                                               adresse_update if adresse_update else None,
-                                               int(fournisseur_id_update)))
-                                    conn.commit()
+                                    with db_cursor() as c:
+                                        c.execute("""UPDATE fournisseurs 
+                                                    SET nom=%s, email=%s, telephone=%s, adresse=%s 
+                                                    WHERE id=%s""",
+                                                  (nom_update, 
+                                                   email_update if email_update else None, 
+                                                   telephone_update if telephone_update else None,
+                                                   adresse_update if adresse_update else None,
+                                                   int(fournisseur_id_update)))
                                     log_access(st.session_state.user_id, "fournisseurs", f"Modification ID:{fournisseur_id_update}")
                                     st.success(f"✅ Fournisseur '{nom_update}' modifié!")
                                     get_fournisseurs.clear()
+                                    get_achats.clear()
+                                    count_rows.clear()
                                     st.rerun()
                                 except Exception as e:
-                                    conn.rollback()
                                     st.error(f"❌ Erreur: {e}")
-                                finally:
-                                    release_connection(conn)
 # ========== GESTION DES COMMANDES ==========
 elif menu == "Gestion des Commandes":
     if not has_access("commandes"):
@@ -1534,122 +1999,147 @@ elif menu == "Gestion des Commandes":
     log_access(st.session_state.user_id, "commandes", "Consultation")
     st.header("🛒 Gestion des Commandes")
     
+    peut_ecrire = has_access("commandes", "ecriture")
     tab1, tab2 = st.tabs(["📋 Liste", "➕ Créer"])
     
     with tab1:
-        commandes = get_commandes()
+        recherche = st.text_input("🔍 Rechercher une commande (client, produit, statut)", key="search_commandes").strip()
+        offset = render_pagination("commandes", recherche)
+        commandes = get_commandes(limit=PAGE_SIZE, offset=offset, search=recherche)
         if not commandes.empty:
             st.dataframe(commandes, use_container_width=True, hide_index=True)
             
-            if has_access("commandes", "ecriture"):
+            if peut_ecrire:
                 st.divider()
                 col1, col2 = st.columns(2)
                 
                 with col1:
                     st.subheader("📝 Changer Statut")
-                    col_a, col_b, col_c = st.columns(3)
-                    with col_a:
-                        cmd_id = st.selectbox("Commande N°", commandes['id'].tolist())
-                    with col_b:
-                        statut = st.selectbox("Statut", ["En attente", "En cours", "Livrée", "Annulée"])
-                    with col_c:
-                        st.write("")
-                        st.write("")
-                        if st.button("✅ Mettre à jour"):
-                            conn = get_connection()
-                            try:
-                                c = conn.cursor()
-                                
-                                # Récupérer les infos complètes de la commande avec client et produit
-                                c.execute("""
-                                    SELECT c.statut, c.produit_id, c.quantite, cl.nom, cl.email, p.nom, p.prix
-                                    FROM commandes c
-                                    JOIN clients cl ON c.client_id = cl.id
-                                    JOIN produits p ON c.produit_id = p.id
-                                    WHERE c.id = %s
-                                """, (int(cmd_id),))
-                                cmd_data = c.fetchone()
-                                
-                                if cmd_data:
-                                    ancien_statut = cmd_data[0]
-                                    produit_id = int(cmd_data[1])
-                                    quantite = int(cmd_data[2])
-                                    client_nom = cmd_data[3]
-                                    client_email = cmd_data[4]
-                                    produit_nom = cmd_data[5]
-                                    produit_prix = float(cmd_data[6])
-                                    montant_total = produit_prix * quantite
+                    # Fragment : changer de commande ou de statut ne réexécute que ce bloc
+                    @st.fragment
+                    def changer_statut():
+                        col_a, col_b, col_c = st.columns(3)
+                        with col_a:
+                            cmd_id = st.selectbox("Commande N°", commandes['id'].tolist())
+                        with col_b:
+                            statut = st.selectbox("Statut", ["En attente", "En cours", "Livrée", "Annulée"])
+                        with col_c:
+                            st.write("")
+                            st.write("")
+                            if st.button("✅ Mettre à jour") and not is_double_submit("changer_statut", cmd_id, statut):
+                                try:
+                                    stock_maj_ok = True
+                                    mouvement_stock = None
+                                    with db_cursor() as c:
+                                        # Récupérer les infos complètes de la commande avec client et produit.
+                                        # FOR UPDATE : la ligne de commande reste verrouillée jusqu'au commit, une
+                                        # validation ou annulation concurrente attend puis relit le nouveau statut
+                                        # (le stock ne peut pas être décrémenté ou recrédité deux fois)
+                                        c.execute("""
+                                            SELECT c.statut, c.produit_id, c.quantite, cl.nom, cl.email, p.nom, p.prix
+                                            FROM commandes c
+                                            JOIN clients cl ON c.client_id = cl.id
+                                            JOIN produits p ON c.produit_id = p.id
+                                            WHERE c.id = %s
+                                            FOR UPDATE OF c
+                                        """, (int(cmd_id),))
+                                        cmd_data = c.fetchone()
                                     
-                                    # Logique de décrémentation du stock
-                                    if ancien_statut == "En attente" and statut in ["En cours", "Livrée"]:
-                                        c.execute("SELECT stock FROM produits WHERE id = %s", (produit_id,))
-                                        stock_result = c.fetchone()
+                                        if cmd_data:
+                                            ancien_statut = cmd_data[0]
+                                            produit_id = int(cmd_data[1])
+                                            quantite = int(cmd_data[2])
+                                            client_nom = cmd_data[3]
+                                            client_email = cmd_data[4]
+                                            produit_nom = cmd_data[5]
+                                            produit_prix = float(cmd_data[6])
+                                            montant_total = produit_prix * quantite
                                         
-                                        if stock_result:
-                                            stock_actuel = int(stock_result[0])
+                                            # Logique de décrémentation du stock : contrôle du stock, décrément
+                                            # et changement de statut en une seule requête (CTE)
+                                            if ancien_statut == "En attente" and statut in ["En cours", "Livrée"]:
+                                                c.execute("""
+                                                    WITH stock_maj AS (
+                                                        UPDATE produits SET stock = stock - %s
+                                                        WHERE id = %s AND stock >= %s
+                                                        RETURNING id
+                                                    )
+                                                    UPDATE commandes SET statut = %s
+                                                    WHERE id = %s AND EXISTS (SELECT 1 FROM stock_maj)
+                                                    RETURNING id
+                                                """, (quantite, produit_id, quantite, statut, int(cmd_id)))
                                             
-                                            if stock_actuel >= quantite:
-                                                c.execute("UPDATE produits SET stock = stock - %s WHERE id = %s", (quantite, produit_id))
-                                                st.info(f"📦 Stock décrémenté de {quantite} unités")
+                                                if c.fetchone():
+                                                    mouvement_stock = f"📦 Stock décrémenté de {quantite} unités"
+                                                else:
+                                                    # Rien n'a été modifié : on relit le stock pour le message d'erreur
+                                                    stock_maj_ok = False
+                                                    c.execute("SELECT stock FROM produits WHERE id = %s", (produit_id,))
+                                                    stock_result = c.fetchone()
+                                        
+                                            # Recrémenter si on annule une commande qui était validée
+                                            elif ancien_statut in ["En cours", "Livrée"] and statut == "Annulée":
+                                                c.execute("""
+                                                    WITH stock_maj AS (
+                                                        UPDATE produits SET stock = stock + %s WHERE id = %s
+                                                    )
+                                                    UPDATE commandes SET statut = %s WHERE id = %s
+                                                """, (quantite, produit_id, statut, int(cmd_id)))
+                                                mouvement_stock = f"📦 Stock recrédité de {quantite} unités"
+                                        
                                             else:
-                                                st.error(f"❌ Stock insuffisant ! Disponible: {stock_actuel}, Requis: {quantite}")
-                                                conn.rollback()
-                                                st.stop()
+                                                c.execute("EXECUTE maj_statut_commande_p (%s, %s)", (statut, int(cmd_id)))
+                                
+                                    if not cmd_data:
+                                        st.error("❌ Commande introuvable")
+                                    elif not stock_maj_ok:
+                                        if stock_result:
+                                            st.error(f"❌ Stock insuffisant ! Disponible: {int(stock_result[0])}, Requis: {quantite}")
                                         else:
                                             st.error("❌ Produit introuvable")
-                                            conn.rollback()
-                                            st.stop()
+                                    else:
+                                        if mouvement_stock:
+                                            st.info(mouvement_stock)
                                     
-                                    # Recrémenter si on annule une commande qui était validée
-                                    elif ancien_statut in ["En cours", "Livrée"] and statut == "Annulée":
-                                        c.execute("UPDATE produits SET stock = stock + %s WHERE id = %s", (quantite, produit_id))
-                                        st.info(f"📦 Stock recrédité de {quantite} unités")
+                                        log_access(st.session_state.user_id, "commandes", f"MAJ statut ID:{cmd_id} -> {statut}")
+                                        st.success(f"✅ Statut changé: {statut}")
                                     
-                                    # Mettre à jour le statut
-                                    c.execute("UPDATE commandes SET statut = %s WHERE id = %s", (statut, int(cmd_id)))
-                                    conn.commit()
-                                    
-                                    log_access(st.session_state.user_id, "commandes", f"MAJ statut ID:{cmd_id} -> {statut}")
-                                    st.success(f"✅ Statut changé: {statut}")
-                                    
-                                    # Envoyer l'email de notification au client
-                                    if client_email and statut != ancien_statut:
-                                        with st.spinner("📧 Envoi de l'email au client..."):
-                                            sujet = f"SYGEP - Mise à jour de votre commande #{cmd_id}"
-                                            corps_html = generer_email_confirmation_commande(
-                                                client_nom, 
-                                                produit_nom, 
-                                                quantite, 
-                                                montant_total, 
-                                                cmd_id, 
-                                                statut
-                                            )
+                                        # Envoyer l'email de notification au client
+                                        if client_email and statut != ancien_statut:
+                                            with st.spinner("📧 Envoi de l'email au client..."):
+                                                sujet = f"SYGEP - Mise à jour de votre commande #{cmd_id}"
+                                                corps_html = generer_email_confirmation_commande(
+                                                    client_nom, 
+                                                    produit_nom, 
+                                                    quantite, 
+                                                    montant_total, 
+                                                    cmd_id, 
+                                                    statut
+                                                )
                                             
-                                            email_envoye = send_email_notification(
-                                                client_email, 
-                                                sujet, 
-                                                corps_html
-                                            )
+                                                email_envoye = send_email_notification(
+                                                    client_email, 
+                                                    sujet, 
+                                                    corps_html
+                                                )
                                             
-                                            if email_envoye:
-                                                st.success(f"📧 Email de confirmation envoyé à {client_email}")
-                                            else:
-                                                st.warning(f"⚠️ Email non envoyé (vérifiez la configuration SMTP)")
+                                                if email_envoye:
+                                                    st.success(f"📧 Email de confirmation envoyé à {client_email}")
+                                                else:
+                                                    st.warning(f"⚠️ Email non envoyé (vérifiez la configuration SMTP)")
                                     
-                                    if statut != 'En attente':
-                                        get_pending_orders_count.clear()
+                                        if statut != 'En attente':
+                                            get_pending_orders_count.clear()
                                     
-                                    get_commandes.clear()
-                                    get_produits.clear()
-                                    st.rerun()
-                                else:
-                                    st.error("❌ Commande introuvable")
-                                    
-                            except Exception as e:
-                                conn.rollback()
-                                st.error(f"❌ Erreur: {e}")
-                            finally:
-                                release_connection(conn)
+                                        get_commandes.clear()
+                                        get_produits.clear()
+                                        get_produits_chart.clear()
+                                        get_dashboard_metrics.clear()
+                                        count_rows.clear()
+                                        st.rerun()
+                                except Exception as e:
+                                    st.error(f"❌ Erreur: {e}")
+                    changer_statut()
                 
                 with col2:
                     st.subheader("🗑️ Supprimer une Commande")
@@ -1661,59 +2151,59 @@ elif menu == "Gestion des Commandes":
                         st.write("")
                         st.write("")
                         if st.button("🗑️ Supprimer", type="secondary", key="del_cmd"):
-                            conn = get_connection()
                             try:
-                                c = conn.cursor()
+                                with db_cursor() as c:
+                                    # Avant de supprimer, vérifier si le stock doit être recrédité
+                                    c.execute("SELECT statut, produit_id, quantite FROM commandes WHERE id = %s", (int(cmd_del_id),))
+                                    cmd_data = c.fetchone()
                                 
-                                # Avant de supprimer, vérifier si le stock doit être recrédité
-                                c.execute("SELECT statut, produit_id, quantite FROM commandes WHERE id = %s", (int(cmd_del_id),))
-                                cmd_data = c.fetchone()
-                                
-                                if cmd_data:
-                                    statut_cmd = cmd_data[0]
-                                    produit_id = int(cmd_data[1])
-                                    quantite = int(cmd_data[2])
+                                    if cmd_data:
+                                        statut_cmd = cmd_data[0]
+                                        produit_id = int(cmd_data[1])
+                                        quantite = int(cmd_data[2])
                                     
-                                    # Si la commande était validée (En cours ou Livrée), recréditer le stock
-                                    if statut_cmd in ["En cours", "Livrée"]:
-                                        c.execute("UPDATE produits SET stock = stock + %s WHERE id = %s", (quantite, produit_id))
-                                        st.info(f"📦 Stock recrédité de {quantite} unités")
+                                        # Si la commande était validée (En cours ou Livrée), recréditer le stock
+                                        if statut_cmd in ["En cours", "Livrée"]:
+                                            c.execute("EXECUTE ajuster_stock_p (%s, %s)", (quantite, produit_id))
+                                            st.info(f"📦 Stock recrédité de {quantite} unités")
                                 
-                                c.execute("DELETE FROM commandes WHERE id=%s", (int(cmd_del_id),))
-                                conn.commit()
+                                    c.execute("DELETE FROM commandes WHERE id=%s", (int(cmd_del_id),))
                                 log_access(st.session_state.user_id, "commandes", f"Suppression ID:{cmd_del_id}")
                                 st.success("✅ Commande supprimée!")
                                 get_commandes.clear()
                                 get_pending_orders_count.clear()
                                 get_produits.clear()
+                                get_produits_chart.clear()
+                                get_dashboard_metrics.clear()
+                                count_rows.clear()
                                 st.rerun()
                             except Exception as e:
-                                conn.rollback()
                                 st.error(f"❌ Erreur: {e}")
-                            finally:
-                                release_connection(conn)
         else:
             st.info("📭 Aucune commande")
     
     with tab2:
-        if not has_access("commandes", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Pas de droits d'écriture")
         else:
             st.subheader("➕ Créer une Nouvelle Commande")
             clients = get_clients()
             produits = get_produits()
+            noms_clients = dict(zip(clients['id'].tolist(), clients['nom'].tolist()))
+            libelles_produits = {i: f"{n} - {p:.2f} €" for i, n, p in zip(produits['id'].tolist(), produits['nom'].tolist(), produits['prix'].tolist())}
+            produits_ix = produits.set_index('id')
             
             if clients.empty or produits.empty:
                 st.warning("⚠️ Il faut au moins 1 client et 1 produit")
             else:
                 with st.form("form_commande"):
                     client_id = st.selectbox("Client *", clients['id'].tolist(),
-                                            format_func=lambda x: clients[clients['id']==x]['nom'].iloc[0])
+                                            format_func=noms_clients.get)
                     produit_id = st.selectbox("Produit *", produits['id'].tolist(),
-                                             format_func=lambda x: f"{produits[produits['id']==x]['nom'].iloc[0]} - {produits[produits['id']==x]['prix'].iloc[0]:.2f} €")
+                                             format_func=libelles_produits.get)
                     
-                    # Récupérer le stock max pour ce produit
-                    produit_selectionne = produits[produits['id'] == produit_id].iloc[0]
+                    # Récupérer le stock max pour ce produit (accès direct par id)
+                    produit_selectionne = produits_ix.loc[produit_id]
                     stock_max = int(produit_selectionne['stock'])
                     
                     quantite = st.number_input("Quantité *", min_value=1, max_value=stock_max, step=1, value=1, key="quantite_interne")
@@ -1724,38 +2214,38 @@ elif menu == "Gestion des Commandes":
                     with col2:
                         cancel = st.form_submit_button("❌ Annuler", use_container_width=True)
                     
-                    if submit:
-                        produit = produits[produits['id'] == produit_id].iloc[0]
-                        stock_actuel = int(produit['stock'])
+                    if submit and not is_double_submit("creer_commande", client_id, produit_id, quantite):
+                        produit = produits_ix.loc[produit_id]
                         quantite_int = int(quantite)
                         
-                        if stock_actuel >= quantite_int:
-                            conn = get_connection()
-                            try:
-                                c = conn.cursor()
-                                client_id_py = int(client_id)
-                                produit_id_py = int(produit_id)
-                                
-                                # Créer la commande avec statut "En cours" et décrémenter directement
-                                c.execute("""INSERT INTO commandes (client_id, produit_id, quantite, date, statut) 
-                                            VALUES (%s, %s, %s, CURRENT_DATE, 'En cours')""",
-                                          (client_id_py, produit_id_py, quantite_int))
-                                c.execute("UPDATE produits SET stock = stock - %s WHERE id = %s", (quantite_int, produit_id_py))
-                                conn.commit()
+                        try:
+                            with db_cursor() as c:
+                                # Contrôle du stock, décrément et création de la commande "En cours" en une seule
+                                # requête (creer_commande_p) : l'UPDATE gardé (stock >= quantité) verrouille la ligne
+                                # produit, les commandes concurrentes sur le même produit passent l'une après l'autre
+                                c.execute("EXECUTE creer_commande_p (%s, %s, %s)",
+                                          (quantite_int, int(produit_id), int(client_id)))
+                                commande_creee = c.fetchone()
                                 
+                                if not commande_creee:
+                                    c.execute("SELECT stock FROM produits WHERE id = %s", (int(produit_id),))
+                                    stock_result = c.fetchone()
+                            
+                            if commande_creee:
                                 montant = float(produit['prix']) * quantite_int
                                 log_access(st.session_state.user_id, "commandes", f"Création: {montant:.2f}€")
                                 st.success(f"✅ Commande créée ! Montant: {montant:.2f} €")
                                 get_commandes.clear()
                                 get_produits.clear()
+                                get_produits_chart.clear()
+                                get_dashboard_metrics.clear()
+                                count_rows.clear()
                                 st.rerun()
-                            except Exception as e:
-                                conn.rollback()
-                                st.error(f"❌ Erreur: {e}")
-                            finally:
-                                release_connection(conn)
-                        else:
-                            st.error(f"❌ Stock insuffisant ! Dispo: {stock_actuel}")
+                            else:
+                                stock_actuel = int(stock_result[0]) if stock_result else 0
+                                st.error(f"❌ Stock insuffisant ! Dispo: {stock_actuel}")
+                        except Exception as e:
+                            st.error(f"❌ Erreur: {e}")
 
 # ========== GESTION DES ACHATS ==========
 elif menu == "Gestion des Achats":
@@ -1766,14 +2256,17 @@ elif menu == "Gestion des Achats":
     log_access(st.session_state.user_id, "achats", "Consultation")
     st.header("🛍️ Gestion des Achats")
     
+    peut_ecrire = has_access("achats", "ecriture")
     tab1, tab2 = st.tabs(["📋 Liste", "➕ Créer"])
     
     with tab1:
-        achats = get_achats()
+        recherche = st.text_input("🔍 Rechercher un achat (fournisseur, produit, statut)", key="search_achats").strip()
+        offset = render_pagination("achats", recherche)
+        achats = get_achats(limit=PAGE_SIZE, offset=offset, search=recherche)
         if not achats.empty:
             st.dataframe(achats, use_container_width=True, hide_index=True)
             
-            if has_access("achats", "ecriture"):
+            if peut_ecrire:
                 st.divider()
                 col1, col2 = st.columns(2)
                 
@@ -1785,36 +2278,40 @@ elif menu == "Gestion des Achats":
                     with col_b:
                         st.write("")
                         st.write("")
-                        if st.button("✅ Valider"):
-                            conn = get_connection()
+                        if st.button("✅ Valider") and not is_double_submit("valider_reception", achat_id):
                             try:
-                                c = conn.cursor()
-                                
-                                c.execute("SELECT produit_id, quantite, statut FROM achats WHERE id = %s", (int(achat_id),)) 
-                                achat_data = c.fetchone()
-                                
-                                if achat_data and achat_data[2] != 'Reçue':
-                                    produit_id, quantite, _ = achat_data
-                                    
-                                    c.execute("UPDATE achats SET statut = 'Reçue' WHERE id = %s", (int(achat_id),))
-                                    c.execute("UPDATE produits SET stock = stock + %s WHERE id = %s", (int(quantite), int(produit_id)))
+                                achat_existe = True
+                                with db_cursor() as c:
+                                    # UPDATE gardé sur le statut : une validation concurrente du même achat attend
+                                    # le verrou de ligne puis ne trouve plus rien à modifier (stock crédité une seule fois)
+                                    c.execute("""UPDATE achats SET statut = 'Reçue'
+                                                 WHERE id = %s AND statut IS DISTINCT FROM 'Reçue'
+                                                 RETURNING produit_id, quantite""", (int(achat_id),))
+                                    achat_recu = c.fetchone()
                                     
-                                    conn.commit()
+                                    if achat_recu:
+                                        produit_id, quantite = achat_recu
+                                        c.execute("EXECUTE ajuster_stock_p (%s, %s)", (int(quantite), int(produit_id)))
+                                    else:
+                                        c.execute("SELECT 1 FROM achats WHERE id = %s", (int(achat_id),))
+                                        achat_existe = c.fetchone() is not None
+                                
+                                if achat_recu:
                                     log_access(st.session_state.user_id, "achats", f"Réception validée ID:{achat_id}")
                                     st.success("✅ Réception validée et stock mis à jour.")
                                     get_achats.clear()
                                     get_produits.clear()
+                                    get_produits_chart.clear()
+                                    get_dashboard_metrics.clear()
+                                    count_rows.clear()
                                     st.rerun()
-                                elif achat_data and achat_data[2] == 'Reçue':
+                                elif achat_existe:
                                     st.warning("⚠️ Cet achat est déjà marqué comme reçu.")
                                 else:
                                     st.error("❌ Achat non trouvé.")
                                     
                             except Exception as e:
                                 st.error(f"❌ Erreur: {e}")
-                                conn.rollback()
-                            finally:
-                                release_connection(conn)
                 
                 with col2:
                     st.subheader("🗑️ Supprimer un Achat")
@@ -1826,39 +2323,37 @@ elif menu == "Gestion des Achats":
                         st.write("")
                         st.write("")
                         if st.button("🗑️ Supprimer", type="secondary", key="del_achat"):
-                            conn = get_connection()
                             try:
-                                c = conn.cursor()
-                                c.execute("DELETE FROM achats WHERE id=%s", (int(achat_del_id),))
-                                conn.commit()
+                                with db_cursor() as c:
+                                    c.execute("DELETE FROM achats WHERE id=%s", (int(achat_del_id),))
                                 log_access(st.session_state.user_id, "achats", f"Suppression ID:{achat_del_id}")
                                 st.success("✅ Achat supprimé!")
                                 get_achats.clear()
+                                count_rows.clear()
                                 st.rerun()
                             except Exception as e:
-                                conn.rollback()
                                 st.error(f"❌ Erreur: {e}")
-                            finally:
-                                release_connection(conn)
         else:
             st.info("📭 Aucun achat")
     
     with tab2:
-        if not has_access("achats", "ecriture"):
+        if not peut_ecrire:
             st.warning("⚠️ Pas de droits d'écriture")
         else:
             st.subheader("➕ Créer un Nouvel Achat")
             fournisseurs = get_fournisseurs()
             produits = get_produits()
+            noms_fournisseurs = dict(zip(fournisseurs['id'].tolist(), fournisseurs['nom'].tolist()))
+            noms_produits = dict(zip(produits['id'].tolist(), produits['nom'].tolist()))
             
             if fournisseurs.empty or produits.empty:
                 st.warning("⚠️ Il faut au moins 1 fournisseur et 1 produit")
             else:
                 with st.form("form_achat"):
                     fournisseur_id = st.selectbox("Fournisseur *", fournisseurs['id'].tolist(),
-                                            format_func=lambda x: fournisseurs[fournisseurs['id']==x]['nom'].iloc[0])
+                                            format_func=noms_fournisseurs.get)
                     produit_id = st.selectbox("Produit *", produits['id'].tolist(),
-                                            format_func=lambda x: produits[produits['id']==x]['nom'].iloc[0])
+                                            format_func=noms_produits.get)
                     quantite = st.number_input("Quantité *", min_value=1, step=1, value=1)
                     prix_unitaire = st.number_input("Prix Unitaire (€) *", min_value=0.01, step=0.01, format="%.2f")
                     
@@ -1868,29 +2363,25 @@ elif menu == "Gestion des Achats":
                     with col2:
                         cancel = st.form_submit_button("❌ Annuler", use_container_width=True)
                     
-                    if submit:
+                    if submit and not is_double_submit("creer_achat", fournisseur_id, produit_id, quantite, prix_unitaire):
                         if quantite > 0 and prix_unitaire > 0:
-                            conn = get_connection()
                             try:
-                                c = conn.cursor()
-                                fournisseur_id_py = int(fournisseur_id)
-                                produit_id_py = int(produit_id)
-                                quantite_py = int(quantite)
-                                prix_unitaire_py = float(prix_unitaire)
+                                with db_cursor() as c:
+                                    fournisseur_id_py = int(fournisseur_id)
+                                    produit_id_py = int(produit_id)
+                                    quantite_py = int(quantite)
+                                    prix_unitaire_py = float(prix_unitaire)
                                 
-                                c.execute("""INSERT INTO achats (fournisseur_id, produit_id, quantite, prix_unitaire, date, statut) 
-                                            VALUES (%s, %s, %s, %s, CURRENT_DATE, 'En attente')""",
-                                          (fournisseur_id_py, produit_id_py, quantite_py, prix_unitaire_py))
-                                conn.commit()
+                                    c.execute("""INSERT INTO achats (fournisseur_id, produit_id, quantite, prix_unitaire, date, statut) 
+                                                VALUES (%s, %s, %s, %s, CURRENT_DATE, 'En attente')""",
+                                              (fournisseur_id_py, produit_id_py, quantite_py, prix_unitaire_py))
                                 log_access(st.session_state.user_id, "achats", f"Création: {quantite_py} x {prix_unitaire_py}€")
                                 st.success(f"✅ Commande d'achat créée !")
                                 get_achats.clear()
+                                count_rows.clear()
                                 st.rerun()
                             except Exception as e:
-                                conn.rollback()
                                 st.error(f"❌ Erreur: {e}")
-                            finally:
-                                release_connection(conn)
                         else:
                             st.error("❌ Quantité et Prix Unitaire requis")
 
@@ -1903,29 +2394,28 @@ elif menu == "Rapports & Exports":
     log_access(st.session_state.user_id, "rapports", "Consultation")
     st.header("📊 Rapports & Exports")
     
+    # Chargés une seule fois et partagés : tous les onglets s'exécutent à chaque rerun
+    clients = get_clients()
+    produits = get_produits()
+    commandes = get_commandes()
+    achats = get_achats()
+    
     tab1, tab2, tab3 = st.tabs(["📈 Statistiques", "💾 Exports", "📉 Analyses"])
     
     with tab1:
         st.subheader("📊 Vue d'Ensemble")
         
-        clients = get_clients()
-        produits = get_produits()
-        commandes = get_commandes()
-        achats = get_achats()
-        
+        # Indicateurs agrégés côté base (mêmes chiffres que le tableau de bord)
+        nb_clients, nb_produits, nb_commandes, ca_total, _, _ = get_dashboard_metrics()
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("👥 Total Clients", len(clients))
+            st.metric("👥 Total Clients", nb_clients)
         with col2:
-            st.metric("📦 Total Produits", len(produits))
+            st.metric("📦 Total Produits", nb_produits)
         with col3:
-            st.metric("🛒 Total Commandes", len(commandes))
+            st.metric("🛒 Total Commandes", nb_commandes)
         with col4:
-            if not commandes.empty:
-                ca = commandes['montant'].sum()
-                st.metric("💰 CA Total", f"{ca:.2f} €")
-            else:
-                st.metric("💰 CA Total", "0.00 €")
+            st.metric("💰 CA Total", f"{ca_total:.2f} €")
         
         st.divider()
         
@@ -1952,7 +2442,6 @@ elif menu == "Rapports & Exports":
         
         with col1:
             st.write("**Export Clients**")
-            clients = get_clients()
             if not clients.empty:
                 csv_clients = clients.to_csv(index=False).encode('utf-8')
                 st.download_button(
@@ -1965,7 +2454,6 @@ elif menu == "Rapports & Exports":
                 st.info("Pas de données")
             
             st.write("**Export Produits**")
-            produits = get_produits()
             if not produits.empty:
                 csv_produits = produits.to_csv(index=False).encode('utf-8')
                 st.download_button(
@@ -1979,7 +2467,6 @@ elif menu == "Rapports & Exports":
         
         with col2:
             st.write("**Export Commandes**")
-            commandes = get_commandes()
             if not commandes.empty:
                 csv_commandes = commandes.to_csv(index=False).encode('utf-8')
                 st.download_button(
@@ -1992,7 +2479,6 @@ elif menu == "Rapports & Exports":
                 st.info("Pas de données")
             
             st.write("**Export Achats**")
-            achats = get_achats()
             if not achats.empty:
                 csv_achats = achats.to_csv(index=False).encode('utf-8')
                 st.download_button(
@@ -2007,8 +2493,6 @@ elif menu == "Rapports & Exports":
     with tab3:
         st.subheader("📉 Analyses Avancées")
         
-        commandes = get_commandes()
-        
         if not commandes.empty:
             col1, col2 = st.columns(2)
             
@@ -2034,104 +2518,105 @@ elif menu == "Gestion des Utilisateurs":
     log_access(st.session_state.user_id, "utilisateurs", "Consultation")
     st.header("👤 Gestion des Utilisateurs & Permissions")
     
+    # Chargés une seule fois et partagés entre les onglets Utilisateurs et Permissions
+    users = get_utilisateurs()
+    
     tab1, tab2, tab3 = st.tabs(["📋 Utilisateurs", "🔑 Permissions", "📊 Logs"])
     
     with tab1:
         st.subheader("📋 Liste des Utilisateurs")
-        conn = get_connection()
-        try:
-            users = pd.read_sql_query("SELECT id, username, role, date_creation FROM utilisateurs ORDER BY id", conn)
-            st.dataframe(users, use_container_width=True, hide_index=True)
-            
-            st.divider()
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                user_id = st.selectbox("Supprimer", users['id'].tolist(),
-                                      format_func=lambda x: users[users['id']==x]['username'].iloc[0])
-            with col2:
-                st.write("")
-                st.write("")
-                if st.button("🗑️ Supprimer"):
-                    if users[users['id']==user_id]['username'].iloc[0] == st.session_state.username:
-                        st.error("❌ Impossible de vous auto-supprimer")
-                    else:
-                        c = conn.cursor()
+        noms_users = dict(zip(users['id'].tolist(), users['username'].tolist()))
+        st.dataframe(users, use_container_width=True, hide_index=True)
+        
+        st.divider()
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            user_id = st.selectbox("Supprimer", users['id'].tolist(),
+                                  format_func=noms_users.get)
+        with col2:
+            st.write("")
+            st.write("")
+            if st.button("🗑️ Supprimer"):
+                if noms_users[user_id] == st.session_state.username:
+                    st.error("❌ Impossible de vous auto-supprimer")
+                else:
+                    with db_cursor() as c:
+                        # Révoque ses sessions : ses jetons sont refusés dès leur prochaine vérification en base
+                        c.execute("DELETE FROM sessions WHERE user_id=%s", (int(user_id),))
                         c.execute("DELETE FROM utilisateurs WHERE id=%s", (int(user_id),))
-                        conn.commit()
-                        log_access(st.session_state.user_id, "utilisateurs", f"Suppression ID:{user_id}")
-                        st.success("✅ Utilisateur supprimé")
-                        st.rerun()
-        finally:
-            release_connection(conn)
+                    log_access(st.session_state.user_id, "utilisateurs", f"Suppression ID:{user_id}")
+                    st.success("✅ Utilisateur supprimé")
+                    get_utilisateurs.clear()
+                    get_user_permissions.clear()
+                    st.rerun()
     
     with tab2:
         st.subheader("🔑 Gérer les Permissions")
-        conn = get_connection()
-        try:
-            users = pd.read_sql_query("SELECT id, username, role FROM utilisateurs", conn)
-            user_sel = st.selectbox("Utilisateur", users['id'].tolist(),
-                                   format_func=lambda x: f"{users[users['id']==x]['username'].iloc[0]} ({users[users['id']==x]['role'].iloc[0]})")
-            
+        libelles_users = {i: f"{u} ({r})" for i, u, r in zip(users['id'].tolist(), users['username'].tolist(), users['role'].tolist())}
+        user_sel = st.selectbox("Utilisateur", users['id'].tolist(),
+                               format_func=libelles_users.get)
+        
+        st.divider()
+        
+        perms = get_user_permissions(int(user_sel))
+        
+        modules = ["tableau_bord", "clients", "produits", "fournisseurs", "commandes", "achats", "rapports", "utilisateurs"]
+        new_perms = {}
+        
+        for mod in modules:
+            st.write(f"**{mod.replace('_', ' ').title()}**")
+            col1, col2 = st.columns(2)
+            current = perms.get(mod, {'lecture': False, 'ecriture': False})
+            with col1:
+                lec = st.checkbox(f"📖 Lecture", value=current['lecture'], key=f"{mod}_lec")
+            with col2:
+                ecr = st.checkbox(f"✏️ Écriture", value=current['ecriture'], key=f"{mod}_ecr")
+            new_perms[mod] = {'lecture': lec, 'ecriture': ecr}
             st.divider()
-            
-            c = conn.cursor()
-            c.execute("SELECT module, acces_lecture, acces_ecriture FROM permissions WHERE user_id=%s", (user_sel,))
-            perms = {r[0]: {'lecture': bool(r[1]), 'ecriture': bool(r[2])} for r in c.fetchall()}
-            
-            modules = ["tableau_bord", "clients", "produits", "fournisseurs", "commandes", "achats", "rapports", "utilisateurs"]
-            new_perms = {}
-            
-            for mod in modules:
-                st.write(f"**{mod.replace('_', ' ').title()}**")
-                col1, col2 = st.columns(2)
-                current = perms.get(mod, {'lecture': False, 'ecriture': False})
-                with col1:
-                    lec = st.checkbox(f"📖 Lecture", value=current['lecture'], key=f"{mod}_lec")
-                with col2:
-                    ecr = st.checkbox(f"✏️ Écriture", value=current['ecriture'], key=f"{mod}_ecr")
-                new_perms[mod] = {'lecture': lec, 'ecriture': ecr}
-                st.divider()
-            
-            if st.button("💾 Enregistrer Permissions", type="primary", use_container_width=True):
-                user_sel_py = int(user_sel)
+        
+        if st.button("💾 Enregistrer Permissions", type="primary", use_container_width=True):
+            user_sel_py = int(user_sel)
+            lignes = [(user_sel_py, mod, p['lecture'], p['ecriture'])
+                      for mod, p in new_perms.items() if p['lecture'] or p['ecriture']]
+            # Suppression + réinsertion dans une seule transaction
+            with db_cursor() as c:
                 c.execute("DELETE FROM permissions WHERE user_id=%s", (user_sel_py,))
-                for mod, p in new_perms.items():
-                    if p['lecture'] or p['ecriture']:
-                        c.execute("INSERT INTO permissions (user_id, module, acces_lecture, acces_ecriture) VALUES (%s, %s, %s, %s)",
-                                  (user_sel_py, mod, p['lecture'], p['ecriture']))
-                conn.commit()
-                log_access(st.session_state.user_id, "utilisateurs", f"MAJ permissions ID:{user_sel}")
-                st.success("✅ Permissions mises à jour")
-                st.rerun()
-        finally:
-            release_connection(conn)
+                if lignes:
+                    execute_values(c, "INSERT INTO permissions (user_id, module, acces_lecture, acces_ecriture) VALUES %s",
+                                   lignes)
+            get_user_permissions.clear()
+            log_access(st.session_state.user_id, "utilisateurs", f"MAJ permissions ID:{user_sel}")
+            # Pas de rerun forcé : les cases affichées reflètent déjà l'état enregistré
+            st.success("✅ Permissions mises à jour")
     
     with tab3:
         st.subheader("📊 Logs d'Accès")
-        conn = get_connection()
-        try:
-            logs = pd.read_sql_query("""
-                SELECT l.date_heure, u.username, l.module, l.action
-                FROM logs_acces l
-                JOIN utilisateurs u ON l.user_id = u.id
-                ORDER BY l.date_heure DESC
-                LIMIT 100
-            """, conn)
+        # Pagination par curseur (id < dernier id vu) : pas d'OFFSET à parcourir sur une table qui grossit
+        curseurs = st.session_state.setdefault('logs_cursors', [])
+        logs = get_logs(curseurs[-1] if curseurs else None)
+        
+        col_prec, col_suiv = st.columns(2)
+        with col_prec:
+            if curseurs and st.button("⬅️ Plus récents", use_container_width=True):
+                curseurs.pop()
+                st.rerun()
+        with col_suiv:
+            if len(logs) == LOGS_PAGE_SIZE and st.button("Plus anciens ➡️", use_container_width=True):
+                curseurs.append(int(logs['id'].iloc[-1]))
+                st.rerun()
+        
+        if not logs.empty:
+            st.dataframe(logs.drop(columns='id'), use_container_width=True, hide_index=True)
             
-            if not logs.empty:
-                st.dataframe(logs, use_container_width=True, hide_index=True)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.subheader("📈 Actions par Module")
-                    st.bar_chart(logs['module'].value_counts())
-                with col2:
-                    st.subheader("👥 Actions par Utilisateur")
-                    st.bar_chart(logs['username'].value_counts().head(10))
-            else:
-                st.info("Aucun log")
-        finally:
-            release_connection(conn)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.subheader("📈 Actions par Module")
+                st.bar_chart(logs['module'].value_counts())
+            with col2:
+                st.subheader("👥 Actions par Utilisateur")
+                st.bar_chart(logs['username'].value_counts().head(10))
+        else:
+            st.info("Aucun log")
 
 # ========== À PROPOS ==========
 elif menu == "À Propos":
@@ -2176,7 +2661,7 @@ elif menu == "À Propos":
     - **Frontend** : Streamlit (Python)
     - **Backend** : PostgreSQL via Supabase
     - **Hébergement** : Streamlit Cloud
-    - **Sécurité** : SHA-256, Permissions granulaires
+    - **Sécurité** : Argon2id, Permissions granulaires
     
     ### ✨ Nouvelles Fonctionnalités v3.2
     